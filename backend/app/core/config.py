@@ -56,6 +56,7 @@ class Settings(BaseSettings):
     # Google Gemini Configuration (Primary AI)
     GOOGLE_GEMINI_API_KEY: Optional[str] = None
     GEMINI_MODEL: str = "gemini-1.5-flash"  # Fast and free model
+    GEMINI_REQUESTS_PER_MINUTE: int = 60  # Client-side throttle for bulk labeling calls
 
     # Kaggle API Configuration
     KAGGLE_USERNAME: Optional[str] = None
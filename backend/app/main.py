@@ -171,15 +171,39 @@ async def startup_db_client():
             logger.warning("[AZURE] Dataset and model operations will fail")
 
         await mongodb.connect()
-        logger.info("Application startup complete")
     except Exception as e:
         logger.error(f"Error during startup: {str(e)}")
         # Don't raise - allow app to start even with errors
         # Health check will report the issue
 
+    # Each remaining step is independent: one failing mustn't skip the others
+    from app.services.payment_service import payment_service
+    from app.services.labeling_service import labeling_service
+    startup_steps = [
+        # Webhook idempotency lookups rely on the unique event_id index
+        ("payment indexes", payment_service.ensure_indexes),
+        # Shared labeling cache: keyed lookups and TTL cleanup of expired responses
+        ("labeling indexes", labeling_service.ensure_indexes),
+    ]
+    for name, step in startup_steps:
+        try:
+            await step()
+        except Exception as e:
+            logger.error(f"Error during startup ({name}): {str(e)}")
+
+    try:
+        # Also sweeps for webhooks stored but not processed (at boot and periodically)
+        payment_service.start_webhook_workers()
+    except Exception as e:
+        logger.error(f"Error during startup (webhook workers): {str(e)}")
+
+    logger.info("Application startup complete")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     try:
+        from app.services.payment_service import payment_service
+        await payment_service.stop_webhook_workers()
         await mongodb.close()
     except Exception as e:
         logger.error(f"Error during shutdown: {str(e)}")
@@ -641,6 +641,7 @@ class WebhookEvent(BaseModel):
 
     # Timestamps
     processed_at: Optional[datetime] = None  # When successfully processed
+    processing_started_at: Optional[datetime] = None  # When the current processing attempt claimed it
     next_retry_at: Optional[datetime] = None  # When to retry if failed
 
     # Error Tracking
@@ -2,6 +2,7 @@
 Add-on Management Endpoints
 Handles add-on catalog, purchases, and management
 """
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException, status
 from app.mongodb import mongodb
 from app.models.mongodb_models import User
@@ -196,7 +197,8 @@ async def create_addon_order(
             }
         }
 
-        razorpay_order = payment_service.client.order.create(data=order_data)
+        # The Razorpay SDK is synchronous (requests); keep it off the event loop
+        razorpay_order = await asyncio.to_thread(payment_service.client.order.create, data=order_data)
         logger.info(f"Razorpay order created for add-on: {razorpay_order['id']}")
 
         return CreateAddonOrderResponse(
@@ -241,7 +243,7 @@ async def verify_addon_payment(
 
     # Fetch payment details from Razorpay
     try:
-        payment_details = payment_service.client.payment.fetch(request.razorpay_payment_id)
+        payment_details = await asyncio.to_thread(payment_service.client.payment.fetch, request.razorpay_payment_id)
         logger.info(f"Add-on payment verified: {request.razorpay_payment_id}")
     except Exception as e:
         logger.error(f"Failed to fetch payment details: {str(e)}")
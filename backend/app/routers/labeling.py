@@ -1,7 +1,9 @@
 from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form
 from typing import List
+import asyncio
 import logging
-import json
+import os
+import orjson
 
 from app.services.labeling_service import labeling_service
 from app.schemas.labeling_schemas import (
@@ -20,6 +22,17 @@ from app.models.mongodb_models import User
 router = APIRouter(prefix="/api/labeling", tags=["labeling"])
 logger = logging.getLogger(__name__)
 
+# Text uploads larger than this are decoded in a worker thread so the event loop
+# keeps serving other requests
+THREADED_DECODE_BYTES = 1024 * 1024
+
+# Media family by file extension, used when the upload's content type doesn't say
+MEDIA_FAMILY_BY_EXTENSION = {
+    **dict.fromkeys(('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'), "image"),
+    **dict.fromkeys(('.txt', '.csv', '.md'), "text"),
+    **dict.fromkeys(('.mp3', '.wav', '.mp4', '.avi', '.mov'), "audio_video"),
+}
+
 
 @router.post("/generate-labels", response_model=LabelingResponse)
 async def generate_labels(
@@ -41,9 +54,9 @@ async def generate_labels(
     try:
         # Parse configuration
         try:
-            config_dict = json.loads(config)
+            config_dict = orjson.loads(config)
             labeling_config = LabelingConfig(**config_dict)
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             raise HTTPException(status_code=400, detail=f"Invalid config JSON: {str(e)}")
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Invalid configuration: {str(e)}")
@@ -68,28 +81,37 @@ async def generate_labels(
         text_files = []
         audio_video_files = []
 
-        for file in files:
-            content = await file.read()
+        # Read all uploads concurrently (large ones are spooled to disk)
+        contents = await asyncio.gather(*(file.read() for file in files))
+
+        for file, content in zip(files, contents):
 
             # Detect file type
             content_type = file.content_type or ""
             filename = file.filename or "unknown"
+            family = MEDIA_FAMILY_BY_EXTENSION.get(os.path.splitext(filename)[1].lower())
 
-            if content_type.startswith("image/") or filename.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')):
+            if content_type.startswith("image/") or family == "image":
                 image_files.append((filename, content))
-            elif content_type.startswith("text/") or filename.lower().endswith(('.txt', '.csv', '.md')):
+            elif content_type.startswith("text/") or family == "text":
                 try:
-                    text_content = content.decode('utf-8')
+                    if len(content) > THREADED_DECODE_BYTES:
+                        text_content = await asyncio.to_thread(content.decode, 'utf-8')
+                    else:
+                        text_content = content.decode('utf-8')
                     text_files.append((filename, text_content))
                 except UnicodeDecodeError:
                     errors.append(f"Could not decode text file: {filename}")
                     error_count += 1
-            elif content_type.startswith(("audio/", "video/")) or filename.lower().endswith(('.mp3', '.wav', '.mp4', '.avi', '.mov')):
+            elif content_type.startswith(("audio/", "video/")) or family == "audio_video":
                 audio_video_files.append((filename, content))
             else:
                 errors.append(f"Unsupported file type: {filename} ({content_type})")
                 error_count += 1
 
+        # Text files are kept as decoded str; drop the raw upload bytes for the rest of the request
+        del contents, content
+
         # Process based on task type
         try:
             if labeling_config.task_type in [LabelingTaskType.IMAGE_CLASSIFICATION, LabelingTaskType.OBJECT_DETECTION]:
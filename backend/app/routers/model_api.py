@@ -11,6 +11,7 @@ from app.services.model_inference import model_inference
 from app.services.usage_tracker import usage_tracker
 from app.middleware.rate_limiter import enforce_rate_limit
 from datetime import datetime
+import asyncio
 import secrets
 
 router = APIRouter(prefix="/v1", tags=["Model API"])
@@ -130,7 +131,9 @@ async def predict_vader_batch(
                     detail="Each text must be under 5000 characters"
                 )
 
-        result = model_inference.predict_vader_batch(
+        # Up to 100 x 5000 chars of pure-Python scoring: keep it off the event loop
+        result = await asyncio.to_thread(
+            model_inference.predict_vader_batch,
             batch_request.texts,
             batch_request.options
         )
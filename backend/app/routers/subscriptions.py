@@ -273,8 +273,8 @@ async def razorpay_webhook(
 
         logger.info(f"Webhook received: {event} (ID: {event_id}) from IP: {source_ip}")
 
-        # Process webhook with full context
-        result = await payment_service.handle_webhook(
+        # Queue webhook for processing with full context (acknowledged immediately)
+        result = await payment_service.enqueue_webhook(
             event=event,
             payload=payload,
             event_id=event_id,
@@ -34,6 +34,12 @@ class LabelingConfig(BaseModel):
         le=1.0,
         description="Minimum confidence threshold for labels"
     )
+    batch_size: Optional[int] = Field(
+        None,
+        ge=1,
+        le=50,
+        description="Number of short texts packed into a single AI request (1 disables batching)"
+    )
 
 
 class DetectedObject(BaseModel):
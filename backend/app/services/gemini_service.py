@@ -4,6 +4,7 @@ import logging
 from typing import List, Dict, Optional, Any, Union
 
 import google.generativeai as genai
+import orjson
 from sklearn.metrics.pairwise import cosine_similarity
 
 from app.core.config import settings
@@ -17,6 +18,45 @@ DEFAULT_MODELS = [
     "gemini-pro",
 ]
 
+
+def stream_chunk_text(chunk: Any) -> str:
+    """
+    Text of one streamed response chunk.
+
+    chunk.text raises ValueError for chunks without text parts (blocked by safety
+    filters, or finish-reason only); those contribute nothing.
+    """
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+
+async def close_stream(response: Any) -> None:
+    """
+    Cancel a streamed response that was not read to the end, so the connection is released.
+
+    Relies on the private _done/_iterator attributes of google-generativeai 0.8.5 (pinned
+    in requirements.txt); if an SDK upgrade removes them this logs a warning rather than
+    silently leaving the stream open.
+    """
+    if getattr(response, "_done", False):
+        return
+    cancel = getattr(getattr(response, "_iterator", None), "cancel", None)
+    if cancel is None:
+        logger.warning(
+            f"Can't cancel Gemini stream ({type(response).__name__} has no _iterator.cancel); "
+            "check the google-generativeai version"
+        )
+        return
+    try:
+        result = cancel()
+        if asyncio.iscoroutine(result):
+            await result
+    except Exception as e:
+        logger.warning(f"Could not cancel Gemini stream: {str(e)}")
+
+
 class GeminiService:
     """
     Service for interacting with Google's Gemini API.
@@ -67,6 +107,7 @@ class GeminiService:
         self,
         messages: List[Dict[str, str]],
         system_prompt: Optional[str] = None,
+        generation_config: Optional[genai.GenerationConfig] = None,
     ) -> str:
         """
         Generate a response from the Gemini model based on chat history.
@@ -74,6 +115,7 @@ class GeminiService:
         Args:
             messages: List of message dictionaries with 'role' and 'content'.
             system_prompt: Optional system prompt to guide the model's behavior.
+            generation_config: Optional per-call config (e.g. JSON response mode).
 
         Returns:
             The generated response string.
@@ -111,11 +153,11 @@ unique patterns that could benefit from custom model training."""
             user_message = messages[-1]["content"]
             full_prompt = f"{system_prompt}\n\nUser: {user_message}"
 
-            # Run blocking I/O in a separate thread
-            response = await asyncio.to_thread(
-                self._run_chat, chat_history, full_prompt
-            )
-            return response
+            # Native async call: concurrent requests overlap on the event loop
+            # instead of each occupying a worker thread
+            chat = self.model.start_chat(history=chat_history)
+            response = await chat.send_message_async(full_prompt, generation_config=generation_config)
+            return response.text
 
         except Exception as e:
             error_str = str(e).lower()
@@ -127,18 +169,10 @@ unique patterns that could benefit from custom model training."""
 
             if is_quota_error:
                 logger.error(f"Gemini Quota/Auth Error: {e}")
-                raise Exception("We're experiencing high demand at the moment. For assistance, please contact us at info@darshix.com")
+                raise Exception("We're experiencing high demand at the moment. For assistance, please contact us at info@darshix.com") from e
             else:
                 logger.error(f"Gemini General Error: {e}")
-                raise Exception("We're experiencing technical difficulties. Please try again or contact us at info@darshix.com for support.")
-
-    def _run_chat(self, history: List[Dict[str, Any]], prompt: str) -> str:
-        """Helper to run chat generation synchronously."""
-        if not self.model:
-            raise ValueError("Model not initialized")
-        chat = self.model.start_chat(history=history)
-        response = chat.send_message(prompt)
-        return response.text
+                raise Exception("We're experiencing technical difficulties. Please try again or contact us at info@darshix.com for support.") from e
 
     async def analyze_dataset_query(self, user_message: str) -> Dict[str, Any]:
         """
@@ -571,7 +605,7 @@ Return plain text, conversational tone."""
             text = text[7:]
         if text.endswith("```"):
             text = text[:-3]
-        return json.loads(text.strip())
+        return orjson.loads(text.strip())
 
 # Global instance for backward compatibility
 gemini_service = GeminiService()
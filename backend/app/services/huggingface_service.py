@@ -1,4 +1,5 @@
 from typing import List, Dict, Optional, Any
+from dataclasses import dataclass, field, asdict
 import httpx
 from datetime import datetime, timedelta
 from app.mongodb import mongodb
@@ -11,6 +12,23 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+
+@dataclass(slots=True)
+class HFDatasetRow:
+    """Lightweight row built while iterating HfApi results; converted to a dict only at the cache/JSON boundary."""
+    id: str
+    title: str
+    description: str
+    source: str
+    url: str
+    downloads: int
+    name: str
+    likes: int
+    tags: List[str] = field(default_factory=list)
+    size: int = 0
+    size_str: str = "Unknown"
+
+
 class HuggingFaceService:
     BASE_URL = "https://huggingface.co/api"
     CACHE_DURATION_HOURS = 24
@@ -198,9 +216,10 @@ class HuggingFaceService:
 
         try:
             # Run blocking search in thread
-            processed_datasets = await asyncio.to_thread(
+            rows = await asyncio.to_thread(
                 self._search_datasets_sync, query, limit, sort, direction
             )
+            processed_datasets = [asdict(row) for row in rows]
 
             logger.info(f"✓ Found {len(processed_datasets)} from Hugging Face.")
 
@@ -219,7 +238,7 @@ class HuggingFaceService:
         limit: int,
         sort: str,
         direction: int
-    ) -> List[Dict[str, Any]]:
+    ) -> List[HFDatasetRow]:
         """Synchronous helper for dataset search."""
         from huggingface_hub import HfApi
 
@@ -271,19 +290,20 @@ class HuggingFaceService:
                 logger.warning(f"Error extracting size for {d.id}: {e}")
                 pass  # Keep default values if parsing fails
 
-            processed_datasets.append({
-                "id": d.id,
-                "title": d.id.split('/')[-1],
-                "description": getattr(d, 'description', '') or d.id,
-                "source": "HuggingFace",
-                "url": f"https://huggingface.co/datasets/{d.id}",
-                "downloads": getattr(d, 'downloads', 0),
-                "name": d.id.split('/')[-1],
-                "likes": getattr(d, 'likes', 0),
-                "tags": getattr(d, 'tags', []),
-                "size": dataset_size,  # Add size information
-                "size_str": size_str,  # Human-readable size
-            })
+            short_name = d.id.split('/')[-1]
+            processed_datasets.append(HFDatasetRow(
+                id=d.id,
+                title=short_name,
+                description=getattr(d, 'description', '') or d.id,
+                source="HuggingFace",
+                url=f"https://huggingface.co/datasets/{d.id}",
+                downloads=getattr(d, 'downloads', 0),
+                name=short_name,
+                likes=getattr(d, 'likes', 0),
+                tags=getattr(d, 'tags', []),
+                size=dataset_size,  # Add size information
+                size_str=size_str,  # Human-readable size
+            ))
         return processed_datasets
 
     async def download_dataset(
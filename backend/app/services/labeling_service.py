@@ -1,12 +1,35 @@
 import asyncio
-import json
+import contextlib
+import hashlib
 import logging
-from typing import List, Dict, Any, Union
+import mimetypes
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import List, Dict, Any, Union, Optional, Callable, Awaitable, Set, Tuple
 from io import BytesIO
 
-from PIL import Image
+import google.generativeai as genai
+import orjson
+from aiolimiter import AsyncLimiter
+from google.api_core.exceptions import (
+    DeadlineExceeded,
+    InternalServerError,
+    NotFound,
+    ResourceExhausted,
+    ServiceUnavailable,
+    TooManyRequests,
+)
+from PIL import Image, UnidentifiedImageError
+from pymongo import IndexModel
 
-from app.services.gemini_service import gemini_service
+from app.core.config import settings
+from app.mongodb import mongodb
+from app.services.gemini_service import gemini_service, stream_chunk_text, close_stream
 from app.schemas.labeling_schemas import (
     LabelingConfig,
     LabelingTaskType,
@@ -20,15 +43,191 @@ from app.schemas.labeling_schemas import (
 
 logger = logging.getLogger(__name__)
 
+# Optional accelerated JPEG codec (libjpeg-turbo); Pillow is used when unavailable
+try:
+    from turbojpeg import TurboJPEG
+    _turbojpeg = TurboJPEG()
+    TURBOJPEG_AVAILABLE = True
+except Exception:  # ImportError or missing libturbojpeg shared library
+    _turbojpeg = None
+    TURBOJPEG_AVAILABLE = False
+
+# Optional OpenCV for fast (SIMD) array resizing
+try:
+    import cv2
+    import numpy as np
+    CV2_AVAILABLE = True
+except ImportError:
+    CV2_AVAILABLE = False
+
+# Shared by every labeling call (built once): a bare JSON body with no markdown
+# fences or prose, and low temperature so repeated labeling is consistent.
+# No max_output_tokens: batched entity results and transcripts can be long.
+LABELING_GENERATION_CONFIG = genai.GenerationConfig(
+    temperature=0.1,
+    response_mime_type="application/json"
+)
+
+# Transient Gemini errors (quota, overload, timeouts) worth retrying; anything
+# else (bad request, auth, safety block) fails immediately
+RETRYABLE_ERRORS = (
+    ResourceExhausted,
+    TooManyRequests,
+    ServiceUnavailable,
+    DeadlineExceeded,
+    InternalServerError,
+)
+
+# Body of a ```json ... ``` (or bare ```) markdown block in model output
+CODE_BLOCK_RE = re.compile(r"```(?:json)?\s*([\s\S]*?)```")
+
+# Sentiment word in a free-text (non-JSON) model response
+SENTIMENT_WORD_RE = re.compile(r"\b(positive|negative|neutral)\b", re.IGNORECASE)
+
+MAX_IMAGE_DIMENSION = 1536
+JPEG_QUALITY = 85
+SMALL_JPEG_BYTES = 500_000  # JPEGs under this size and dimension limit are sent as-is
+# Common upload formats; Image.open tries only these plugins first, then falls back to all
+IMAGE_FORMATS = ('JPEG', 'PNG', 'WEBP', 'GIF', 'BMP')
+
+# Per-worker-thread scratch state (reusable JPEG output buffer)
+_tls = threading.local()
+
+# Static per-task instructions for vision calls. They are bound once as the
+# model's system_instruction so each request only carries the dynamic tail.
+IMAGE_CLASSIFICATION_INSTRUCTION = (
+    "You are an expert image classifier. Analyze each image carefully and classify it.\n\n"
+    "IMPORTANT: Respond ONLY with valid JSON in this exact format (no markdown, no code blocks):\n"
+    '{"classification": "your_label_here", "confidence": 0.95, "description": "brief description of what you see"}'
+)
+OBJECT_DETECTION_INSTRUCTION = (
+    "You are an expert object detector. Identify and list all distinct objects visible in each image.\n\n"
+    "IMPORTANT: Respond ONLY with valid JSON in this exact format (no markdown, no code blocks):\n"
+    '{"objects": [{"label": "object_name", "confidence": 0.95}, {"label": "another_object", "confidence": 0.85}], "description": "overall scene description"}'
+)
+TRANSCRIPTION_INSTRUCTION = (
+    "You are an expert transcriber. Transcribe the spoken content of each file accurately and detect its language.\n\n"
+    "IMPORTANT: Respond ONLY with valid JSON in this exact format (no markdown, no code blocks):\n"
+    '{"transcript": "full transcript", "language": "en", "confidence": 0.95, "summary": "brief summary", "key_points": ["point one", "point two"]}'
+)
+
+# Payloads above this size are sent through the Gemini Files API instead of inline
+INLINE_MEDIA_LIMIT = 4 * 1024 * 1024
+
+# Texts longer than this are uploaded once as a text/plain file and referenced,
+# instead of being inlined into every prompt
+LARGE_TEXT_CHARS = 64_000
+ATTACHED_TEXT_NOTE = "(provided as the attached text file)"
+
+# mimetypes names that Gemini spells differently
+GEMINI_MIME_ALIASES = {
+    "audio/x-wav": "audio/wav",
+    "video/quicktime": "video/mov",
+    "video/x-msvideo": "video/avi",
+}
+
+# Static prefixes for text prompts. The input text always goes last so that
+# every request in a batch shares the same leading bytes (implicit prefix caching).
+_TEXT_JSON_ONLY = "IMPORTANT: Respond ONLY with valid JSON in this exact format (no markdown, no code blocks, no explanatory text):\n"
+_BATCHED_JSON_ONLY = "IMPORTANT: Respond ONLY with valid JSON in this exact format (no markdown, no code blocks, no explanatory text), with one entry per input index:\n"
+_ENTITY_TYPES = "Identify entities such as: PERSON (people's names), ORG (organizations, companies), LOCATION (places, countries, cities), DATE (dates, times), MONEY (monetary amounts), PRODUCT (product names), etc."
+
+TEXT_CLASSIFICATION_PREFIX = "Classify the text given under INPUT.\n\n"
+TEXT_CLASSIFICATION_FORMAT = (
+    _TEXT_JSON_ONLY
+    + '{"label": "category_name", "confidence": 0.95, "explanation": "brief reason for this classification"}'
+)
+SENTIMENT_ANALYSIS_PREFIX = (
+    "Analyze the sentiment of the text given under INPUT.\n\n"
+    + _TEXT_JSON_ONLY
+    + '{"sentiment": "positive/negative/neutral", "label": "positive/negative/neutral", "confidence": 0.95, "explanation": "brief reason for this sentiment"}'
+)
+ENTITY_EXTRACTION_PREFIX = (
+    "Extract all named entities from the text given under INPUT.\n\n"
+    + _ENTITY_TYPES + "\n\n"
+    + _TEXT_JSON_ONLY
+    + '{"entities": [{"text": "entity text", "type": "PERSON", "start_index": 0, "end_index": 10, "confidence": 0.95}], "summary": "brief summary of the text"}'
+)
+
+BATCHED_TEXT_CLASSIFICATION_PREFIX = "Classify each text in the JSON array given under INPUT independently.\n\n"
+BATCHED_TEXT_CLASSIFICATION_FORMAT = (
+    _BATCHED_JSON_ONLY
+    + '{"results": [{"index": 0, "label": "category_name", "confidence": 0.95, "explanation": "brief reason for this classification"}]}'
+)
+BATCHED_SENTIMENT_ANALYSIS_PREFIX = (
+    "Analyze the sentiment of each text in the JSON array given under INPUT independently.\n\n"
+    + _BATCHED_JSON_ONLY
+    + '{"results": [{"index": 0, "sentiment": "positive/negative/neutral", "label": "positive/negative/neutral", "confidence": 0.95, "explanation": "brief reason for this sentiment"}]}'
+)
+BATCHED_ENTITY_EXTRACTION_PREFIX = (
+    "Extract all named entities from each text in the JSON array given under INPUT independently.\n\n"
+    + _ENTITY_TYPES + " Character indices are relative to each individual text.\n\n"
+    + _BATCHED_JSON_ONLY
+    + '{"results": [{"index": 0, "entities": [{"text": "entity text", "type": "PERSON", "start_index": 0, "end_index": 10, "confidence": 0.95}], "summary": "brief summary of the text"}]}'
+)
+
+
+@lru_cache(maxsize=512)
+def _label_constraint(instruction: str, default: str, target_labels: Tuple[str, ...]) -> str:
+    """Label constraint line for a set of target labels (same for every item in a request)"""
+    if target_labels:
+        return f"{instruction}: {', '.join(target_labels)}"
+    return default
+
+
+@lru_cache(maxsize=512)
+def _classification_head(prefix: str, default: str, response_format: str, target_labels: Tuple[str, ...]) -> str:
+    """Static head of a text classification prompt, built once per label set"""
+    constraint = _label_constraint("Choose ONLY from these categories", default, target_labels)
+    return f"{prefix}{constraint}\n\n{response_format}"
+
 
 class LabelingService:
     """Service for AI-powered data labeling using Google Gemini"""
 
+    # Vision models in order of preference (latest Gemini models that support vision)
+    VISION_MODEL_NAMES = [
+        'models/gemini-2.5-flash',  # Latest stable multimodal model
+        'models/gemini-flash-latest',  # Latest flash model
+        'models/gemini-2.0-flash',  # Gemini 2.0 Flash
+    ]
+
+    # First available vision model name, shared by all instances for the process
+    # lifetime, plus one model per system instruction built from it
+    _vision_model_name: Optional[str] = None
+    _vision_models: Dict[Optional[str], genai.GenerativeModel] = {}
+    # Names whose generation calls returned NotFound; skipped when resolving again
+    _unusable_vision_models: Set[str] = set()
+    _vision_model_lock = asyncio.Lock()
+
     def __init__(self):
         """Initialize the labeling service with Gemini"""
         self.gemini_service = gemini_service
         self.max_retries = 3
         self.retry_delay_base = 2  # seconds
+        self.max_concurrency = 8  # Max in-flight Gemini calls (respects API quotas)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        # Full-resolution decodes running at once (each holds a decoded bitmap in memory)
+        self.max_optimize_concurrency = 3
+        self._optimize_semaphore = asyncio.Semaphore(self.max_optimize_concurrency)
+        # Audio/video uploads waiting on Files API processing (kept off the generation slots)
+        self.max_concurrent_uploads = 4
+        self._upload_semaphore = asyncio.Semaphore(self.max_concurrent_uploads)
+        # Token bucket shared by all labeling calls, so large batches throttle up front
+        # instead of running into quota errors and backing off
+        self._rate_limiter = AsyncLimiter(settings.GEMINI_REQUESTS_PER_MINUTE, 60)
+        self.text_batch_size = 16  # Texts packed into one prompt (overridable via config.batch_size)
+        self.max_batched_text_chars = 2000  # Longer texts are labeled with their own call
+        # Gemini Files API handles keyed by SHA-256 of the uploaded bytes: (file, expires_at)
+        self.file_cache_size = 256
+        self.file_ttl_seconds = 46 * 3600  # Uploaded files are deleted by Gemini after 48h
+        self.file_processing_timeout = 300  # Max seconds to wait for an upload to leave PROCESSING
+        self._file_cache: OrderedDict = OrderedDict()
+        # Exact-match cache of Gemini responses keyed by SHA-256 of the request (LRU)
+        self.response_cache_size = 2048
+        self._response_cache: OrderedDict = OrderedDict()
+        # Second tier shared by all workers and restarts (MongoDB, same keys)
+        self.shared_cache_ttl_hours = 24 * 7
 
     async def label_images(
         self,
@@ -45,34 +244,51 @@ class LabelingService:
         Returns:
             List of ImageLabel objects
         """
-        results = []
-
-        for filename, image_bytes in image_files:
+        # Stage 1: optimize every image up front; decode/resize/encode release the
+        # GIL, so a few worker threads run in parallel (bounded to keep memory flat)
+        optimized_images = await asyncio.gather(*(
+            self._optimize_image_bounded(image_bytes)
+            for _, image_bytes in image_files
+        ))
+
+        # Stage 2: fan out the Gemini calls on the pre-optimized bytes
+        tasks = [
+            self._label_one_image(filename, optimized_bytes, config)
+            for (filename, _), optimized_bytes in zip(image_files, optimized_images)
+        ]
+        return await asyncio.gather(*tasks)
+
+    async def _optimize_image_bounded(self, image_bytes: bytes) -> bytes:
+        """Optimize an image on a worker thread, at most max_optimize_concurrency at a time"""
+        async with self._optimize_semaphore:
+            return await asyncio.to_thread(self._optimize_image, image_bytes)
+
+    async def _label_one_image(
+        self,
+        filename: str,
+        optimized_bytes: bytes,
+        config: LabelingConfig
+    ) -> ImageLabel:
+        """Label a single (already optimized) image, returning an error label on failure"""
+        async with self._semaphore:
             try:
-                # Optimize image
-                optimized_bytes = self._optimize_image(image_bytes)
-
                 # Generate labels based on task type
                 if config.task_type == LabelingTaskType.IMAGE_CLASSIFICATION:
-                    label = await self._classify_image(filename, optimized_bytes, config)
+                    return await self._classify_image(filename, optimized_bytes, config)
                 elif config.task_type == LabelingTaskType.OBJECT_DETECTION:
-                    label = await self._detect_objects(filename, optimized_bytes, config)
+                    return await self._detect_objects(filename, optimized_bytes, config)
                 else:
                     raise ValueError(f"Unsupported task type for images: {config.task_type}")
 
-                results.append(label)
-
             except Exception as e:
                 logger.error(f"Error labeling image {filename}: {str(e)}")
                 # Add error label
-                results.append(ImageLabel(
+                return ImageLabel(
                     filename=filename,
                     task_type=config.task_type.value,
                     classification="ERROR",
                     confidence=0.0
-                ))
-
-        return results
+                )
 
     async def label_text(
         self,
@@ -89,28 +305,33 @@ class LabelingService:
         Returns:
             List of TextLabel objects
         """
-        results = []
+        return await self._label_in_batches(
+            texts, config, self._classify_text_batch, self._label_one_text
+        )
 
-        for identifier, text_content in texts:
+    async def _label_one_text(
+        self,
+        identifier: str,
+        text_content: str,
+        config: LabelingConfig
+    ) -> TextLabel:
+        """Label a single text, returning an error label on failure"""
+        async with self._semaphore:
             try:
                 if config.task_type == LabelingTaskType.TEXT_CLASSIFICATION:
-                    label = await self._classify_text(text_content, config)
+                    return await self._classify_text(text_content, config)
                 elif config.task_type == LabelingTaskType.SENTIMENT_ANALYSIS:
-                    label = await self._analyze_sentiment(text_content, config)
+                    return await self._analyze_sentiment(text_content, config)
                 else:
                     raise ValueError(f"Unsupported task type for text: {config.task_type}")
 
-                results.append(label)
-
             except Exception as e:
                 logger.error(f"Error labeling text {identifier}: {str(e)}")
-                results.append(TextLabel(
+                return TextLabel(
                     text=text_content[:100],
                     label="ERROR",
                     confidence=0.0
-                ))
-
-        return results
+                )
 
     async def extract_entities(
         self,
@@ -127,20 +348,153 @@ class LabelingService:
         Returns:
             List of EntityExtraction objects
         """
-        results = []
+        return await self._label_in_batches(
+            texts, config, self._extract_entities_batch, self._extract_one
+        )
 
-        for identifier, text_content in texts:
+    async def _extract_one(
+        self,
+        identifier: str,
+        text_content: str,
+        config: LabelingConfig
+    ) -> EntityExtraction:
+        """Extract entities from a single text, returning an empty extraction on failure"""
+        async with self._semaphore:
             try:
-                extraction = await self._extract_entities(text_content, config)
-                results.append(extraction)
+                return await self._extract_entities(text_content, config)
 
             except Exception as e:
                 logger.error(f"Error extracting entities from {identifier}: {str(e)}")
-                results.append(EntityExtraction(
+                return EntityExtraction(
                     text=text_content[:100],
                     entities=[]
-                ))
+                )
 
+    async def _label_in_batches(
+        self,
+        texts: List[tuple],
+        config: LabelingConfig,
+        batch_fn: Callable[[List[tuple], LabelingConfig], Awaitable[list]],
+        single_fn: Callable[[str, str, LabelingConfig], Awaitable[Any]]
+    ) -> list:
+        """
+        Pack short texts into batched prompts and label long texts individually
+
+        Results are returned in the same order as the input texts.
+        """
+        batch_size = config.batch_size or self.text_batch_size
+        batchable = []
+        singles = []
+        for index, (_, text_content) in enumerate(texts):
+            if batch_size > 1 and len(text_content) <= self.max_batched_text_chars:
+                batchable.append(index)
+            else:
+                singles.append(index)
+
+        batches = [batchable[i:i + batch_size] for i in range(0, len(batchable), batch_size)]
+        # A lone text gains nothing from the batched prompt format
+        singles.extend(batch[0] for batch in batches if len(batch) == 1)
+        batches = [batch for batch in batches if len(batch) > 1]
+
+        batch_results, single_results = await asyncio.gather(
+            asyncio.gather(*(batch_fn([texts[i] for i in batch], config) for batch in batches)),
+            asyncio.gather(*(single_fn(*texts[i], config) for i in singles))
+        )
+
+        results: List[Any] = [None] * len(texts)
+        for batch, labels in zip(batches, batch_results):
+            for index, label in zip(batch, labels):
+                results[index] = label
+        for index, label in zip(singles, single_results):
+            results[index] = label
+        return results
+
+    async def _classify_text_batch(
+        self,
+        texts: List[tuple],
+        config: LabelingConfig
+    ) -> List[TextLabel]:
+        """Classify (or sentiment-label) several texts with a single Gemini call"""
+        results: List[Optional[TextLabel]] = [None] * len(texts)
+
+        async with self._semaphore:
+            try:
+                if config.task_type == LabelingTaskType.TEXT_CLASSIFICATION:
+                    prompt = self._build_batched_text_classification_prompt(texts, config)
+                    default_label = "unknown"
+                elif config.task_type == LabelingTaskType.SENTIMENT_ANALYSIS:
+                    prompt = self._build_batched_sentiment_analysis_prompt(texts, config)
+                    default_label = "neutral"
+                else:
+                    raise ValueError(f"Unsupported task type for text: {config.task_type}")
+
+                response = await self._call_gemini_with_retry(prompt)
+                data = orjson.loads(self._clean_json_response(response))
+
+                for item in data.get("results", []):
+                    index = item.get("index")
+                    if isinstance(index, int) and 0 <= index < len(texts) and results[index] is None:
+                        results[index] = TextLabel(
+                            text=texts[index][1],
+                            label=item.get("label", default_label),
+                            sentiment=item.get("sentiment") if config.task_type == LabelingTaskType.SENTIMENT_ANALYSIS else None,
+                            confidence=item.get("confidence", 0.8),
+                            explanation=item.get("explanation")
+                        )
+            except Exception as e:
+                logger.warning(f"Batched text labeling failed, falling back to per-item calls: {str(e)}")
+
+        return await self._fill_missing(results, texts, config, self._label_one_text)
+
+    async def _extract_entities_batch(
+        self,
+        texts: List[tuple],
+        config: LabelingConfig
+    ) -> List[EntityExtraction]:
+        """Extract named entities from several texts with a single Gemini call"""
+        results: List[Optional[EntityExtraction]] = [None] * len(texts)
+
+        async with self._semaphore:
+            try:
+                prompt = self._build_batched_entity_extraction_prompt(texts, config)
+                response = await self._call_gemini_with_retry(prompt)
+                data = orjson.loads(self._clean_json_response(response))
+
+                for item in data.get("results", []):
+                    index = item.get("index")
+                    if isinstance(index, int) and 0 <= index < len(texts) and results[index] is None:
+                        results[index] = EntityExtraction(
+                            text=texts[index][1],
+                            entities=[
+                                Entity(
+                                    text=ent.get("text", ""),
+                                    type=ent.get("type", "UNKNOWN"),
+                                    start_index=ent.get("start_index", 0),
+                                    end_index=ent.get("end_index", 0),
+                                    confidence=ent.get("confidence", 0.8)
+                                )
+                                for ent in item.get("entities", [])
+                            ],
+                            summary=item.get("summary")
+                        )
+            except Exception as e:
+                logger.warning(f"Batched entity extraction failed, falling back to per-item calls: {str(e)}")
+
+        return await self._fill_missing(results, texts, config, self._extract_one)
+
+    async def _fill_missing(
+        self,
+        results: list,
+        texts: List[tuple],
+        config: LabelingConfig,
+        single_fn: Callable[[str, str, LabelingConfig], Awaitable[Any]]
+    ) -> list:
+        """Label any texts a batched response did not cover with individual calls"""
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            fallback = await asyncio.gather(*(single_fn(*texts[i], config) for i in missing))
+            for index, label in zip(missing, fallback):
+                results[index] = label
         return results
 
     async def transcribe_audio_video(
@@ -151,7 +505,8 @@ class LabelingService:
         """
         Transcribe audio/video files
 
-        Note: This is a placeholder as Gemini's audio support may be limited
+        Files are uploaded once through the Gemini Files API and referenced
+        from the prompt instead of being sent inline.
 
         Args:
             files: List of tuples (filename, file_bytes)
@@ -160,28 +515,62 @@ class LabelingService:
         Returns:
             List of Transcript objects
         """
-        results = []
+        tasks = [
+            self._transcribe_one(filename, file_bytes, config)
+            for filename, file_bytes in files
+        ]
+        return await asyncio.gather(*tasks)
+
+    async def _transcribe_one(
+        self,
+        filename: str,
+        file_bytes: bytes,
+        config: LabelingConfig
+    ) -> Transcript:
+        """
+        Transcribe a single audio/video file, returning an error transcript on failure
+
+        Takes a concurrency slot only for the generation call: waiting for Gemini to
+        process an upload would otherwise block every other labeling task.
+        """
+        try:
+            default_mime = "video/mp4" if config.task_type == LabelingTaskType.VIDEO_ANALYSIS else "audio/mpeg"
+            mime_type = mimetypes.guess_type(filename)[0] or default_mime
+            mime_type = GEMINI_MIME_ALIASES.get(mime_type, mime_type)
+
+            response = await self._call_gemini_with_image(
+                self._build_transcription_prompt(config),
+                file_bytes,
+                TRANSCRIPTION_INSTRUCTION,
+                mime_type=mime_type,
+                take_slot=True
+            )
 
-        for filename, file_bytes in files:
             try:
-                # For now, return a placeholder
-                # In production, you would integrate with Gemini's audio API or another service
-                results.append(Transcript(
+                data = orjson.loads(self._clean_json_response(response))
+                return Transcript(
                     filename=filename,
-                    transcript="[Audio transcription requires additional setup]",
-                    confidence=0.0,
-                    summary="Audio transcription is not yet fully implemented"
-                ))
-
-            except Exception as e:
-                logger.error(f"Error transcribing {filename}: {str(e)}")
-                results.append(Transcript(
+                    transcript=data.get("transcript", ""),
+                    language=data.get("language"),
+                    confidence=data.get("confidence", 0.8),
+                    summary=data.get("summary"),
+                    key_points=data.get("key_points")
+                )
+            except orjson.JSONDecodeError:
+                logger.error(f"Failed to parse JSON response for {filename}: {response}")
+                return Transcript(
                     filename=filename,
-                    transcript="ERROR",
-                    confidence=0.0
-                ))
+                    transcript=response,
+                    confidence=0.5
+                )
 
-        return results
+        except Exception as e:
+            logger.error(f"Error transcribing {filename}: {str(e)}")
+            return Transcript(
+                filename=filename,
+                transcript="ERROR",
+                confidence=0.0
+            )
 
     async def refine_labels(
         self,
@@ -222,35 +611,126 @@ class LabelingService:
         - Compress to reduce size
         """
         try:
-            img = Image.open(BytesIO(image_bytes))
+            try:
+                img = Image.open(BytesIO(image_bytes), formats=IMAGE_FORMATS)  # Parses the header only
+            except UnidentifiedImageError:
+                # Less common uploads (TIFF etc.): let Pillow try every decoder
+                img = Image.open(BytesIO(image_bytes))
+
+            # Already a small JPEG: a decode/encode round-trip would gain nothing
+            if (
+                img.format == 'JPEG'
+                and img.mode in ('RGB', 'L')
+                and max(img.size) <= MAX_IMAGE_DIMENSION
+                and len(image_bytes) < SMALL_JPEG_BYTES
+            ):
+                return image_bytes
+        except Exception as e:
+            logger.error(f"Error optimizing image: {str(e)}")
+            return image_bytes
+
+        # JPEG input: decode/encode with libjpeg-turbo when available
+        if TURBOJPEG_AVAILABLE and img.format == 'JPEG':
+            try:
+                return self._optimize_jpeg_turbo(image_bytes)
+            except Exception as e:
+                logger.debug(f"TurboJPEG optimization failed, falling back to Pillow: {str(e)}")
 
+        try:
             # Resize if larger than 1536px
-            max_size = 1536
+            max_size = MAX_IMAGE_DIMENSION
             if max(img.size) > max_size:
                 ratio = max_size / max(img.size)
                 new_size = tuple(int(dim * ratio) for dim in img.size)
-                img = img.resize(new_size, Image.Resampling.LANCZOS)
+                if img.format == 'JPEG':
+                    # Decode at a reduced DCT scale (still >= new_size) instead of full size
+                    img.draft('RGB', new_size)
+                if CV2_AVAILABLE:
+                    # INTER_AREA is faster than LANCZOS and the better filter for shrinking
+                    img = self._to_rgb(img)
+                    pixels = cv2.resize(np.asarray(img), new_size, interpolation=cv2.INTER_AREA)
+                    img = Image.fromarray(pixels)
+                else:
+                    # reducing_gap: shrink by an integer factor with a box filter first,
+                    # then LANCZOS over the much smaller intermediate
+                    img = img.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=3.0)
 
             # Convert to RGB (handle RGBA, grayscale, etc.)
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-
-            # Save as JPEG with compression
-            output = BytesIO()
-            img.save(output, format='JPEG', quality=85, optimize=True)
+            img = self._to_rgb(img)
+
+            # Save as JPEG with compression into this thread's reusable buffer
+            output = getattr(_tls, 'output', None)
+            if output is None:
+                output = _tls.output = BytesIO()
+            output.seek(0)
+            output.truncate()
+            img.save(output, format='JPEG', quality=JPEG_QUALITY)  # No extra Huffman-optimization pass
             return output.getvalue()
 
         except Exception as e:
             logger.error(f"Error optimizing image: {str(e)}")
             return image_bytes
 
+    def _to_rgb(self, img: Image.Image) -> Image.Image:
+        """
+        Convert to RGB for JPEG encoding
+
+        Transparent images are flattened onto white; a plain convert('RGB') would
+        expose whatever colour sits under the alpha (usually black).
+        """
+        if img.mode == 'RGB':
+            return img
+        if img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+            rgba = img.convert('RGBA')
+            background = Image.new('RGB', rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            return background
+        return img.convert('RGB')
+
+    def _optimize_jpeg_turbo(self, image_bytes: bytes) -> bytes:
+        """Resize and re-encode a JPEG with TurboJPEG (and OpenCV for resizing)"""
+        width, height, _, _ = _turbojpeg.decode_header(image_bytes)
+        ratio = MAX_IMAGE_DIMENSION / max(width, height)
+        if ratio < 1 and not CV2_AVAILABLE:
+            raise RuntimeError("OpenCV is required to resize on the TurboJPEG path")
+
+        pixels = _turbojpeg.decode(image_bytes)  # BGR array
+        if ratio < 1:
+            new_size = (int(width * ratio), int(height * ratio))
+            pixels = cv2.resize(pixels, new_size, interpolation=cv2.INTER_AREA)
+
+        return _turbojpeg.encode(pixels, quality=JPEG_QUALITY)
+
+    def _detect_image_mime_type(self, image_bytes: bytes) -> str:
+        """Detect image MIME type from magic bytes (optimized images are always JPEG)"""
+        if image_bytes[:3] == b'\xff\xd8\xff':
+            return "image/jpeg"
+        if image_bytes[:8] == b'\x89PNG\r\n\x1a\n':
+            return "image/png"
+        if image_bytes[:4] == b'RIFF' and image_bytes[8:12] == b'WEBP':
+            return "image/webp"
+        if image_bytes[:6] in (b'GIF87a', b'GIF89a'):
+            return "image/gif"
+        if image_bytes[:2] == b'BM':
+            return "image/bmp"
+        return "image/jpeg"
+
     def _clean_json_response(self, response: str) -> str:
         """Clean JSON response by removing markdown code blocks"""
-        # Remove markdown code blocks if present
-        if "```json" in response:
-            response = response.split("```json")[1].split("```")[0]
-        elif "```" in response:
-            response = response.split("```")[1].split("```")[0]
+        # JSON-mode responses are already bare JSON
+        if response.startswith('{'):
+            return response
+
+        # Markdown code block: take its body
+        match = CODE_BLOCK_RE.search(response)
+        if match:
+            return match.group(1).strip()
+
+        # Otherwise keep the outermost {...} span, dropping any surrounding prose
+        start = response.find('{')
+        end = response.rfind('}')
+        if start != -1 and end > start:
+            return response[start:end + 1]
         return response.strip()
 
     async def _classify_image(
@@ -264,12 +744,12 @@ class LabelingService:
         prompt = self._build_image_classification_prompt(config)
 
         # Call Gemini with image
-        response = await self._call_gemini_with_image(prompt, image_bytes)
+        response = await self._call_gemini_with_image(prompt, image_bytes, IMAGE_CLASSIFICATION_INSTRUCTION)
 
         # Clean and parse response
         try:
             cleaned_response = self._clean_json_response(response)
-            data = json.loads(cleaned_response)
+            data = orjson.loads(cleaned_response)
             return ImageLabel(
                 filename=filename,
                 task_type=config.task_type.value,
@@ -277,7 +757,7 @@ class LabelingService:
                 scene_description=data.get("description"),
                 confidence=data.get("confidence", 0.8)
             )
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"Failed to parse JSON response for {filename}: {response}")
             # Fallback: use text response as classification
             return ImageLabel(
@@ -296,11 +776,11 @@ class LabelingService:
         """Detect objects in an image"""
         prompt = self._build_object_detection_prompt(config)
 
-        response = await self._call_gemini_with_image(prompt, image_bytes)
+        response = await self._call_gemini_with_image(prompt, image_bytes, OBJECT_DETECTION_INSTRUCTION)
 
         try:
             cleaned_response = self._clean_json_response(response)
-            data = json.loads(cleaned_response)
+            data = orjson.loads(cleaned_response)
             objects = [
                 DetectedObject(
                     label=obj.get("label", "unknown"),
@@ -317,7 +797,7 @@ class LabelingService:
                 scene_description=data.get("description"),
                 confidence=data.get("confidence", 0.8)
             )
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"Failed to parse JSON response for {filename}: {response}")
             return ImageLabel(
                 filename=filename,
@@ -333,19 +813,20 @@ class LabelingService:
         config: LabelingConfig
     ) -> TextLabel:
         """Classify text"""
-        prompt = self._build_text_classification_prompt(text, config)
-        response = await self._call_gemini_with_retry(prompt)
+        response = await self._call_gemini_for_text(
+            lambda input_text: self._build_text_classification_prompt(input_text, config), text
+        )
 
         try:
             cleaned_response = self._clean_json_response(response)
-            data = json.loads(cleaned_response)
+            data = orjson.loads(cleaned_response)
             return TextLabel(
                 text=text,
                 label=data.get("label", "unknown"),
                 confidence=data.get("confidence", 0.8),
                 explanation=data.get("explanation")
             )
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"Failed to parse JSON response: {response}")
             return TextLabel(
                 text=text,
@@ -359,12 +840,13 @@ class LabelingService:
         config: LabelingConfig
     ) -> TextLabel:
         """Analyze sentiment of text"""
-        prompt = self._build_sentiment_analysis_prompt(text, config)
-        response = await self._call_gemini_with_retry(prompt)
+        response = await self._call_gemini_for_text(
+            lambda input_text: self._build_sentiment_analysis_prompt(input_text, config), text
+        )
 
         try:
             cleaned_response = self._clean_json_response(response)
-            data = json.loads(cleaned_response)
+            data = orjson.loads(cleaned_response)
             return TextLabel(
                 text=text,
                 label=data.get("label", "neutral"),
@@ -372,16 +854,11 @@ class LabelingService:
                 confidence=data.get("confidence", 0.8),
                 explanation=data.get("explanation")
             )
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"Failed to parse JSON response: {response}")
-            # Fallback: simple sentiment detection
-            response_lower = response.lower()
-            if "positive" in response_lower:
-                sentiment = "positive"
-            elif "negative" in response_lower:
-                sentiment = "negative"
-            else:
-                sentiment = "neutral"
+            # Fallback: first sentiment word mentioned in the response
+            match = SENTIMENT_WORD_RE.search(response)
+            sentiment = match.group(1).lower() if match else "neutral"
 
             return TextLabel(
                 text=text,
@@ -396,12 +873,13 @@ class LabelingService:
         config: LabelingConfig
     ) -> EntityExtraction:
         """Extract named entities from text"""
-        prompt = self._build_entity_extraction_prompt(text, config)
-        response = await self._call_gemini_with_retry(prompt)
+        response = await self._call_gemini_for_text(
+            lambda input_text: self._build_entity_extraction_prompt(input_text, config), text
+        )
 
         try:
             cleaned_response = self._clean_json_response(response)
-            data = json.loads(cleaned_response)
+            data = orjson.loads(cleaned_response)
             entities = [
                 Entity(
                     text=ent.get("text", ""),
@@ -418,7 +896,7 @@ class LabelingService:
                 entities=entities,
                 summary=data.get("summary")
             )
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"Failed to parse JSON response: {response}")
             return EntityExtraction(
                 text=text,
@@ -427,66 +905,68 @@ class LabelingService:
             )
 
     def _build_image_classification_prompt(self, config: LabelingConfig) -> str:
-        """Build prompt for image classification"""
-        prompt = "You are an expert image classifier. Analyze this image carefully and classify it."
-
-        if config.target_labels:
-            labels_str = ", ".join(config.target_labels)
-            prompt += f"\n\nChoose ONLY from these categories: {labels_str}"
-        else:
-            prompt += "\n\nProvide a specific, accurate classification label for what you see in the image."
-
-        prompt += "\n\nIMPORTANT: Respond ONLY with valid JSON in this exact format (no markdown, no code blocks):\n"
-        prompt += '{"classification": "your_label_here", "confidence": 0.95, "description": "brief description of what you see"}'
-
-        return prompt
+        """Build the per-request part of the image classification prompt"""
+        return _label_constraint(
+            "Choose ONLY from these categories",
+            "Provide a specific, accurate classification label for what you see in the image.",
+            tuple(config.target_labels or ())
+        )
 
     def _build_object_detection_prompt(self, config: LabelingConfig) -> str:
-        """Build prompt for object detection"""
-        prompt = "You are an expert object detector. Identify and list all distinct objects visible in this image."
-
-        if config.target_labels:
-            labels_str = ", ".join(config.target_labels)
-            prompt += f"\n\nFocus primarily on detecting these objects: {labels_str}"
-        else:
-            prompt += "\n\nDetect all significant objects you can see."
-
-        prompt += "\n\nIMPORTANT: Respond ONLY with valid JSON in this exact format (no markdown, no code blocks):\n"
-        prompt += '{"objects": [{"label": "object_name", "confidence": 0.95}, {"label": "another_object", "confidence": 0.85}], "description": "overall scene description"}'
-
-        return prompt
+        """Build the per-request part of the object detection prompt"""
+        return _label_constraint(
+            "Focus primarily on detecting these objects",
+            "Detect all significant objects you can see.",
+            tuple(config.target_labels or ())
+        )
 
     def _build_text_classification_prompt(self, text: str, config: LabelingConfig) -> str:
         """Build prompt for text classification"""
-        prompt = f"Classify the following text:\n\n{text}\n\n"
-
-        if config.target_labels:
-            labels_str = ", ".join(config.target_labels)
-            prompt += f"Choose ONLY from these categories: {labels_str}\n\n"
-        else:
-            prompt += "Provide an appropriate category label for this text.\n\n"
-
-        prompt += "IMPORTANT: Respond ONLY with valid JSON in this exact format (no markdown, no code blocks, no explanatory text):\n"
-        prompt += '{"label": "category_name", "confidence": 0.95, "explanation": "brief reason for this classification"}'
-
-        return prompt
+        head = _classification_head(
+            TEXT_CLASSIFICATION_PREFIX,
+            "Provide an appropriate category label for this text.",
+            TEXT_CLASSIFICATION_FORMAT,
+            tuple(config.target_labels or ())
+        )
+        return head + "\n\nINPUT:\n" + text
 
     def _build_sentiment_analysis_prompt(self, text: str, config: LabelingConfig) -> str:
         """Build prompt for sentiment analysis"""
-        prompt = f"Analyze the sentiment of this text:\n\n{text}\n\n"
-        prompt += "IMPORTANT: Respond ONLY with valid JSON in this exact format (no markdown, no code blocks, no explanatory text):\n"
-        prompt += '{"sentiment": "positive/negative/neutral", "label": "positive/negative/neutral", "confidence": 0.95, "explanation": "brief reason for this sentiment"}'
-
-        return prompt
+        return SENTIMENT_ANALYSIS_PREFIX + "\n\nINPUT:\n" + text
 
     def _build_entity_extraction_prompt(self, text: str, config: LabelingConfig) -> str:
         """Build prompt for entity extraction"""
-        prompt = f"Extract all named entities from this text:\n\n{text}\n\n"
-        prompt += "Identify entities such as: PERSON (people's names), ORG (organizations, companies), LOCATION (places, countries, cities), DATE (dates, times), MONEY (monetary amounts), PRODUCT (product names), etc.\n\n"
-        prompt += "IMPORTANT: Respond ONLY with valid JSON in this exact format (no markdown, no code blocks, no explanatory text):\n"
-        prompt += '{"entities": [{"text": "entity text", "type": "PERSON", "start_index": 0, "end_index": 10, "confidence": 0.95}], "summary": "brief summary of the text"}'
-
-        return prompt
+        return ENTITY_EXTRACTION_PREFIX + "\n\nINPUT:\n" + text
+
+    def _format_batched_texts(self, texts: List[tuple]) -> str:
+        """Serialize a batch of texts as an indexed JSON array for batched prompts"""
+        return orjson.dumps(
+            [{"index": i, "text": text_content} for i, (_, text_content) in enumerate(texts)]
+        ).decode()
+
+    def _build_batched_text_classification_prompt(self, texts: List[tuple], config: LabelingConfig) -> str:
+        """Build prompt for classifying several texts at once"""
+        head = _classification_head(
+            BATCHED_TEXT_CLASSIFICATION_PREFIX,
+            "Provide an appropriate category label for each text.",
+            BATCHED_TEXT_CLASSIFICATION_FORMAT,
+            tuple(config.target_labels or ())
+        )
+        return head + "\n\nINPUT:\n" + self._format_batched_texts(texts)
+
+    def _build_batched_sentiment_analysis_prompt(self, texts: List[tuple], config: LabelingConfig) -> str:
+        """Build prompt for analyzing the sentiment of several texts at once"""
+        return BATCHED_SENTIMENT_ANALYSIS_PREFIX + "\n\nINPUT:\n" + self._format_batched_texts(texts)
+
+    def _build_batched_entity_extraction_prompt(self, texts: List[tuple], config: LabelingConfig) -> str:
+        """Build prompt for extracting entities from several texts at once"""
+        return BATCHED_ENTITY_EXTRACTION_PREFIX + "\n\nINPUT:\n" + self._format_batched_texts(texts)
+
+    def _build_transcription_prompt(self, config: LabelingConfig) -> str:
+        """Build the per-request part of the transcription prompt"""
+        if config.task_type == LabelingTaskType.VIDEO_ANALYSIS:
+            return "Transcribe the speech in this video and summarize what happens on screen."
+        return "Transcribe this audio recording."
 
     def _build_refinement_prompt(
         self,
@@ -494,98 +974,338 @@ class LabelingService:
         feedback: str
     ) -> str:
         """Build prompt for label refinement"""
-        labels_json = json.dumps([label.dict() if hasattr(label, 'dict') else label.model_dump() for label in labels], indent=2)
+        # Labels are pydantic v2 models: serialize each straight to JSON, no dict round-trip
+        labels_json = "[\n" + ",\n".join(label.model_dump_json(indent=2) for label in labels) + "\n]"
         prompt = f"Here are the current labels:\n\n{labels_json}\n\n"
         prompt += f"User feedback: {feedback}\n\n"
         prompt += "Please refine the labels based on this feedback and return the updated labels in the same JSON format."
 
         return prompt
 
+    def _get_cached_response(self, cache_key: str) -> Optional[str]:
+        """Return a cached Gemini response and mark it recently used"""
+        response = self._response_cache.get(cache_key)
+        if response is not None:
+            self._response_cache.move_to_end(cache_key)
+        return response
+
+    def _cache_response(self, cache_key: str, response: str):
+        """Store a Gemini response, evicting the least recently used entry when full"""
+        self._response_cache[cache_key] = response
+        self._response_cache.move_to_end(cache_key)
+        if len(self._response_cache) > self.response_cache_size:
+            self._response_cache.popitem(last=False)
+
+    async def ensure_indexes(self):
+        """Create the shared cache indexes (call from app startup): lookups by cache_key, expiry by TTL"""
+        try:
+            await mongodb.database["labeling_cache"].create_indexes([
+                IndexModel("cache_key", unique=True),
+                IndexModel("expires_at", expireAfterSeconds=0)
+            ])
+        except Exception as e:
+            logger.warning(f"Could not ensure labeling_cache indexes: {str(e)}")
+
+    async def _lookup_response(self, cache_key: str) -> Optional[str]:
+        """Look a response up in the in-process LRU, then in the shared MongoDB cache"""
+        cached = self._get_cached_response(cache_key)
+        if cached is not None:
+            return cached
+
+        try:
+            doc = await mongodb.database["labeling_cache"].find_one({
+                "cache_key": cache_key,
+                "expires_at": {"$gt": datetime.utcnow()}
+            })
+        except Exception as e:
+            logger.debug(f"Labeling cache lookup failed: {str(e)}")
+            return None
+
+        if doc and doc["response"]:
+            self._cache_response(cache_key, doc["response"])
+            return doc["response"]
+        return None
+
+    def _is_cacheable_response(self, response: str) -> bool:
+        """Only well-formed JSON is cached: an empty, blocked or garbled response is retried next time"""
+        if not response:
+            return False
+        try:
+            orjson.loads(self._clean_json_response(response))
+        except orjson.JSONDecodeError:
+            return False
+        return True
+
+    async def _store_response(self, cache_key: str, response: str):
+        """Store a response in both cache tiers (MongoDB failures are non-fatal)"""
+        if not self._is_cacheable_response(response):
+            logger.debug(f"Not caching unparseable Gemini response for {cache_key}")
+            return
+        self._cache_response(cache_key, response)
+        try:
+            await mongodb.database["labeling_cache"].update_one(
+                {"cache_key": cache_key},
+                {
+                    "$set": {
+                        "cache_key": cache_key,
+                        "response": response,
+                        "expires_at": datetime.utcnow() + timedelta(hours=self.shared_cache_ttl_hours),
+                        "created_at": datetime.utcnow()
+                    }
+                },
+                upsert=True
+            )
+        except Exception as e:
+            logger.debug(f"Labeling cache write failed: {str(e)}")
+
     async def _call_gemini_with_retry(self, prompt: str) -> str:
         """Call Gemini API with retry logic"""
+        cache_key = hashlib.sha256(prompt.encode()).hexdigest()
+        cached = await self._lookup_response(cache_key)
+        if cached is not None:
+            return cached
+
         for attempt in range(self.max_retries):
             try:
                 if not self.gemini_service.is_available():
                     raise RuntimeError("Gemini service is not available")
 
-                response = await self.gemini_service.generate_response(
-                    messages=[{"role": "user", "content": prompt}]
-                )
+                async with self._rate_limiter:
+                    response = await self.gemini_service.generate_response(
+                        messages=[{"role": "user", "content": prompt}],
+                        generation_config=LABELING_GENERATION_CONFIG
+                    )
+                await self._store_response(cache_key, response)
                 return response
 
             except Exception as e:
-                error_msg = str(e).lower()
-                if ("rate limit" in error_msg or "quota" in error_msg) and attempt < self.max_retries - 1:
-                    # Exponential backoff
-                    delay = self.retry_delay_base ** (attempt + 1)
-                    logger.warning(f"Rate limit hit, retrying in {delay}s...")
+                if self._is_retryable(e) and attempt < self.max_retries - 1:
+                    delay = self._retry_delay(attempt)
+                    logger.warning(f"Transient Gemini error ({type(e).__name__}), retrying in {delay:.1f}s...")
                     await asyncio.sleep(delay)
                     continue
                 raise
 
-    async def _call_gemini_with_image(self, prompt: str, image_bytes: bytes) -> str:
+    async def _call_gemini_for_text(self, build_prompt: Callable[[str], str], text: str) -> str:
         """
-        Call Gemini API with image using vision capabilities
-        Uses inline image data approach
+        Call Gemini for a single text, inline when short and as an uploaded file when long
+
+        Large documents go through the Files API (uploaded once per content hash),
+        so repeat labeling of the same document doesn't resend it.
         """
-        import google.generativeai as genai
-        from PIL import Image
-        from io import BytesIO
+        if len(text) <= LARGE_TEXT_CHARS:
+            return await self._call_gemini_with_retry(build_prompt(text))
+        return await self._call_gemini_with_image(
+            build_prompt(ATTACHED_TEXT_NOTE), text.encode(), mime_type="text/plain"
+        )
+
+    def _is_retryable(self, error: Exception) -> bool:
+        """Whether an error (or the Gemini error it wraps) is transient"""
+        return isinstance(error, RETRYABLE_ERRORS) or isinstance(error.__cause__, RETRYABLE_ERRORS)
+
+    def _retry_delay(self, attempt: int) -> float:
+        """Exponential backoff with equal jitter, so concurrent tasks don't retry in lockstep"""
+        backoff = self.retry_delay_base ** (attempt + 1)
+        return backoff / 2 + random.uniform(0, backoff / 2)
+
+    def _get_vision_model(self, system_instruction: Optional[str]) -> genai.GenerativeModel:
+        """Return the cached vision model for a system instruction (model name must be resolved)"""
+        model = LabelingService._vision_models.get(system_instruction)
+        if model is None:
+            model = genai.GenerativeModel(
+                LabelingService._vision_model_name,
+                system_instruction=system_instruction,
+                generation_config=LABELING_GENERATION_CONFIG
+            )
+            LabelingService._vision_models[system_instruction] = model
+        return model
 
-        for attempt in range(self.max_retries):
+    async def _upload_once(self, key: str, data: bytes, mime_type: str):
+        """
+        Upload bytes to the Gemini Files API once per content hash and reuse the handle
+
+        Waits (up to file_processing_timeout seconds) until Gemini has finished processing
+        the file (video) before returning. A file that fails or times out is deleted
+        from the Files API and an error raised.
+        """
+        cached = self._file_cache.get(key)
+        if cached is not None and cached[1] > time.monotonic():
+            self._file_cache.move_to_end(key)
+            return cached[0]
+
+        file_ref = await asyncio.to_thread(genai.upload_file, BytesIO(data), mime_type=mime_type)
+        deadline = time.monotonic() + self.file_processing_timeout
+        while file_ref.state.name == "PROCESSING" and time.monotonic() < deadline:
+            await asyncio.sleep(2)
+            file_ref = await asyncio.to_thread(genai.get_file, file_ref.name)
+        if file_ref.state.name in ("PROCESSING", "FAILED"):
+            state = file_ref.state.name
             try:
-                if not self.gemini_service.is_available():
-                    raise RuntimeError("Gemini service is not available")
+                await asyncio.to_thread(genai.delete_file, file_ref.name)
+            except Exception as e:
+                logger.debug(f"Could not delete uploaded file {file_ref.name}: {str(e)}")
+            if state == "PROCESSING":
+                raise TimeoutError(
+                    f"Gemini did not finish processing uploaded file ({mime_type}) "
+                    f"within {self.file_processing_timeout}s"
+                )
+            raise RuntimeError(f"Gemini could not process uploaded file ({mime_type}, state {state})")
 
-                # Convert bytes to PIL Image
-                image = Image.open(BytesIO(image_bytes))
-
-                # Try different model names for vision (in order of preference)
-                # Use the latest available Gemini models that support vision
-                vision_model_names = [
-                    'models/gemini-2.5-flash',  # Latest stable multimodal model
-                    'models/gemini-flash-latest',  # Latest flash model
-                    'models/gemini-2.0-flash',  # Gemini 2.0 Flash
-                ]
-
-                # Try each model until one works
-                last_error = None
-                for model_name in vision_model_names:
-                    try:
-                        logger.info(f"Trying vision model: {model_name}")
-                        vision_model = genai.GenerativeModel(model_name)
-
-                        # Generate content with image and prompt
-                        response = await asyncio.to_thread(
-                            vision_model.generate_content,
-                            [prompt, image]
-                        )
+        self._file_cache[key] = (file_ref, time.monotonic() + self.file_ttl_seconds)
+        self._file_cache.move_to_end(key)
+        if len(self._file_cache) > self.file_cache_size:
+            self._file_cache.popitem(last=False)
+        return file_ref
+
+    async def _generate_json_text(self, model: genai.GenerativeModel, prompt: str, media: Any) -> str:
+        """
+        Stream a vision response and stop reading once the top-level JSON object closes
+
+        Brace depth is tracked across chunks (ignoring braces inside quoted strings);
+        responses without any JSON object are read to completion. A stream left early
+        is cancelled.
+        """
+        async with self._rate_limiter:
+            response = await model.generate_content_async([prompt, media], stream=True)
+        parts: List[str] = []
+        depth = 0
+        started = in_string = escaped = False
+
+        try:
+            async for chunk in response:
+                chunk_text = stream_chunk_text(chunk)
+                parts.append(chunk_text)
+                for char in chunk_text:
+                    if in_string:
+                        if escaped:
+                            escaped = False
+                        elif char == "\\":
+                            escaped = True
+                        elif char == '"':
+                            in_string = False
+                    elif char == '"':
+                        in_string = started
+                    elif char == "{":
+                        depth += 1
+                        started = True
+                    elif char == "}" and started:
+                        depth -= 1
+                        if depth == 0:
+                            break
+                if started and depth == 0:
+                    break
+        finally:
+            await close_stream(response)
+
+        return "".join(parts)
+
+    async def _resolve_vision_model_name(self):
+        """
+        Pick the first available vision model once per process
 
-                        logger.info(f"Successfully used model: {model_name}")
-                        return response.text
-
-                    except Exception as model_error:
-                        last_error = model_error
-                        error_str = str(model_error)
-                        if "404" in error_str or "not found" in error_str.lower():
-                            logger.debug(f"Model {model_name} not available, trying next...")
-                            continue
-                        else:
-                            # For non-404 errors, propagate immediately
-                            logger.error(f"Error with model {model_name}: {str(model_error)}")
-                            raise
-
-                # If all models failed with 404, raise the last error
-                if last_error:
-                    logger.error(f"All vision models failed. Last error: {str(last_error)}")
-                    raise last_error
+        Candidates are checked with a metadata lookup under a lock, so concurrent
+        labeling tasks don't each repeat the 404 round-trips or spend generation calls.
+        A candidate is skipped when the lookup fails for a non-transient reason or the
+        model doesn't support generateContent; transient errors propagate for retry.
+        """
+        if LabelingService._vision_model_name is not None:
+            return
+
+        async with LabelingService._vision_model_lock:
+            if LabelingService._vision_model_name is not None:
+                return
+
+            last_error = None
+            for model_name in self.VISION_MODEL_NAMES:
+                if model_name in LabelingService._unusable_vision_models:
+                    continue
+                try:
+                    model_info = await asyncio.to_thread(genai.get_model, model_name)
+                except Exception as e:
+                    if self._is_retryable(e):
+                        raise
+                    last_error = e
+                    logger.debug(f"Model {model_name} not available ({type(e).__name__}), trying next...")
+                    continue
+
+                if "generateContent" not in (getattr(model_info, "supported_generation_methods", None) or ()):
+                    last_error = RuntimeError(f"Model {model_name} does not support generateContent")
+                    logger.debug(f"Model {model_name} can't generate content, trying next...")
+                    continue
+
+                LabelingService._vision_model_name = model_name
+                logger.info(f"Using vision model: {model_name}")
+                return
+
+            logger.error(f"All vision models failed. Last error: {str(last_error)}")
+            raise last_error or RuntimeError("No usable vision model")
+
+    def _discard_vision_model(self, model_name: str):
+        """Stop using a vision model whose generation calls return NotFound, so the next call re-resolves"""
+        LabelingService._unusable_vision_models.add(model_name)
+        if LabelingService._vision_model_name == model_name:
+            LabelingService._vision_model_name = None
+            LabelingService._vision_models.clear()
+
+    async def _call_gemini_with_image(
+        self,
+        prompt: str,
+        image_bytes: bytes,
+        system_instruction: Optional[str] = None,
+        mime_type: Optional[str] = None,
+        take_slot: bool = False
+    ) -> str:
+        """
+        Call Gemini API with image using vision capabilities
+
+        Small images are sent inline; large payloads and non-image media (audio, video,
+        long text) are uploaded once through the Files API and referenced. With
+        take_slot, the upload runs under the upload semaphore and only the generation
+        call takes a concurrency slot (for callers that don't already hold one).
+        """
+        hasher = hashlib.sha256((system_instruction or "").encode())
+        hasher.update(prompt.encode())
+        hasher.update(image_bytes)
+        cache_key = hasher.hexdigest()
+        cached = await self._lookup_response(cache_key)
+        if cached is not None:
+            return cached
+
+        if not self.gemini_service.is_available():
+            raise RuntimeError("Gemini service is not available")
+        # Build the media part once; retries only repeat the generation call
+        media_type = mime_type or self._detect_image_mime_type(image_bytes)
+        if not media_type.startswith("image/") or len(image_bytes) > INLINE_MEDIA_LIMIT:
+            async with self._upload_semaphore if take_slot else contextlib.nullcontext():
+                image = await self._upload_once(
+                    hashlib.sha256(image_bytes).hexdigest(), image_bytes, media_type
+                )
+        else:
+            # Send the already-encoded bytes as an inline blob; handing over a
+            # PIL image would make the SDK decode and re-encode it again
+            image = {"mime_type": media_type, "data": image_bytes}
+
+        for attempt in range(self.max_retries):
+            model_name = None
+            try:
+                await self._resolve_vision_model_name()
+                model_name = LabelingService._vision_model_name
+                vision_model = self._get_vision_model(system_instruction)
+                async with self._semaphore if take_slot else contextlib.nullcontext():
+                    text = await self._generate_json_text(vision_model, prompt, image)
+                await self._store_response(cache_key, text)
+                return text
 
             except Exception as e:
-                error_msg = str(e).lower()
-                if ("rate limit" in error_msg or "quota" in error_msg) and attempt < self.max_retries - 1:
-                    # Exponential backoff
-                    delay = self.retry_delay_base ** (attempt + 1)
-                    logger.warning(f"Rate limit hit, retrying in {delay}s...")
+                if model_name and isinstance(e, NotFound):
+                    # Listed in metadata but not servable: fall back to the next candidate
+                    logger.warning(f"Vision model {model_name} returned NotFound, falling back")
+                    self._discard_vision_model(model_name)
+                    if attempt < self.max_retries - 1:
+                        continue
+                if self._is_retryable(e) and attempt < self.max_retries - 1:
+                    delay = self._retry_delay(attempt)
+                    logger.warning(f"Transient Gemini error ({type(e).__name__}), retrying in {delay:.1f}s...")
                     await asyncio.sleep(delay)
                     continue
 
@@ -1,26 +1,80 @@
+import asyncio
+import heapq
+import itertools
+import re
+from collections import OrderedDict
 from typing import Dict, List, Optional, Any
 import google.generativeai as genai
-from app.core.config import settings
 from app.mongodb import mongodb
+from app.services.gemini_service import gemini_service, stream_chunk_text, close_stream
 from app.services.huggingface_service import huggingface_service
 from bson import ObjectId
 
 
+# Task keywords as one alternation; groups are listed in priority order and map
+# positionally to TASK_TYPES_BY_GROUP (several keyword groups share a task type)
+TASK_KEYWORDS_RE = re.compile(
+    r"(sentiment|emotion|opinion)"
+    r"|(summarize|summary|summarization)"
+    r"|(translate|translation)"
+    r"|(question|qa|answer)"
+    r"|(classify|classification|categorize)"
+    r"|(image|vision|object detection)",
+    re.IGNORECASE
+)
+TASK_TYPES_BY_GROUP = (
+    "text-classification",
+    "summarization",
+    "translation",
+    "question-answering",
+    "text-classification",
+    "image-classification",
+)
+
+# Static instructions are bound to the models once as system_instruction, so each
+# request only sends the task-specific details
+RECOMMEND_MODELS_INSTRUCTION = """You are an ML expert advisor. Analyze the ML task you are given and recommend the best models.
+
+Provide:
+1. Top 3 recommended models (with model_id, reasoning, pros/cons)
+2. Whether training is needed or pre-built is sufficient
+3. Estimated cost (low/medium/high)
+4. Expected accuracy range
+5. One-sentence summary
+
+Format as JSON."""
+
+MAKE_DECISION_INSTRUCTION = """You are an AI decision engine. Make the optimal model selection decision for the task you are given.
+
+Analyze and decide:
+1. Best single model to use (provide model_id)
+2. Justification (2-3 sentences)
+3. Confidence score (0-1)
+4. Top 2 alternatives
+5. Next steps (3 action items)
+
+Consider: accuracy, speed, cost, ease of use."""
+
+
 class MLOrchestrator:
 
     def __init__(self):
         self.model = None
-        if settings.GOOGLE_GEMINI_API_KEY:
-            genai.configure(api_key=settings.GOOGLE_GEMINI_API_KEY)
-            try:
-                self.model = genai.GenerativeModel(settings.GEMINI_MODEL)
-            except Exception as e:
-                print(f"Failed to load {settings.GEMINI_MODEL}, falling back to gemini-1.5-flash: {e}")
-                try:
-                    self.model = genai.GenerativeModel("gemini-1.5-flash")
-                except Exception as e2:
-                    print(f"Failed to load gemini-1.5-flash, trying gemini-pro: {e2}")
-                    self.model = genai.GenerativeModel("gemini-pro")
+        self.recommend_model = None
+        self.decision_model = None
+        # Gemini reasoning text keyed by (kind, prompt); the prompt already carries every input
+        self.response_cache_size = 256
+        self._response_cache: OrderedDict = OrderedDict()
+        # Reuse the process-wide Gemini setup: calling genai.configure again would
+        # reset the SDK's shared clients (and their pooled connections)
+        self.model = gemini_service.model
+        if self.model is not None:
+            self.recommend_model = genai.GenerativeModel(
+                self.model.model_name, system_instruction=RECOMMEND_MODELS_INSTRUCTION
+            )
+            self.decision_model = genai.GenerativeModel(
+                self.model.model_name, system_instruction=MAKE_DECISION_INSTRUCTION
+            )
 
     def is_available(self) -> bool:
         return self.model is not None
@@ -37,26 +91,20 @@ class MLOrchestrator:
         if not self.is_available():
             raise ValueError("Gemini API is not configured")
 
-        dataset_info = ""
-        if dataset_id and ObjectId.is_valid(dataset_id):
-            dataset = await mongodb.database["datasets"].find_one({"_id": ObjectId(dataset_id)})
-            if dataset:
-                dataset_info = f"\nDataset: {dataset['name']} - {dataset['row_count']} rows, {dataset['column_count']} columns"
-
         task_type = self._detect_task_type(task_description)
 
-        hf_models = await huggingface_service.search_models(
-            task=task_type,
-            limit=10
+        # The lookups are independent: run them concurrently
+        dataset, hf_models, prebuilt_models = await asyncio.gather(
+            self._find_dataset(dataset_id),
+            huggingface_service.search_models(task=task_type, limit=10),
+            self._find_prebuilt_models(task_type)
         )
 
-        prebuilt_models = await mongodb.database["prebuilt_models"].find({
-            "task_type": task_type
-        }).limit(3).to_list(length=3)
-
-        prompt = f"""You are an ML expert advisor. Analyze this ML task and recommend the best models.
+        dataset_info = ""
+        if dataset:
+            dataset_info = f"\nDataset: {dataset['name']} - {dataset['row_count']} rows, {dataset['column_count']} columns"
 
-Task Description: {task_description}
+        prompt = f"""Task Description: {task_description}
 {dataset_info}
 Priority: {priority} (speed/cost/accuracy)
 Budget: ${budget if budget else 'not specified'}
@@ -66,23 +114,14 @@ Available HuggingFace Models:
 {self._format_hf_models(hf_models[:5])}
 
 Available Pre-built Models:
-{self._format_prebuilt_models(prebuilt_models)}
-
-Provide:
-1. Top 3 recommended models (with model_id, reasoning, pros/cons)
-2. Whether training is needed or pre-built is sufficient
-3. Estimated cost (low/medium/high)
-4. Expected accuracy range
-5. One-sentence summary
-
-Format as JSON."""
+{self._format_prebuilt_models(prebuilt_models)}"""
 
         try:
-            response = self.model.generate_content(prompt)
+            response_text = await self._generate_cached(self.recommend_model, "recommend", prompt, 500)
 
             recommendation = {
                 "recommended_models": self._extract_top_models(hf_models, prebuilt_models, priority),
-                "reasoning": response.text[:500] if response.text else "Unable to generate detailed reasoning",
+                "reasoning": response_text[:500] if response_text else "Unable to generate detailed reasoning",
                 "estimated_cost": self._estimate_cost(task_type, budget),
                 "estimated_accuracy": self._estimate_accuracy(priority),
                 "training_required": self._needs_training(task_description, dataset_id),
@@ -114,37 +153,25 @@ Format as JSON."""
         if not ObjectId.is_valid(dataset_id):
             raise ValueError("Invalid dataset ID")
 
-        dataset = await mongodb.database["datasets"].find_one({"_id": ObjectId(dataset_id)})
-        if not dataset:
-            raise ValueError("Dataset not found")
-
         task_type = self._detect_task_type(task_description)
 
-        hf_models = await huggingface_service.search_models(task=task_type, limit=5)
-        prebuilt_models = await mongodb.database["prebuilt_models"].find({
-            "task_type": task_type
-        }).limit(3).to_list(length=3)
-
-        prompt = f"""You are an AI decision engine. Make the optimal model selection decision.
+        dataset, hf_models, prebuilt_models = await asyncio.gather(
+            self._find_dataset(dataset_id),
+            huggingface_service.search_models(task=task_type, limit=5),
+            self._find_prebuilt_models(task_type)
+        )
+        if not dataset:
+            raise ValueError("Dataset not found")
 
-Task: {task_description}
+        prompt = f"""Task: {task_description}
 Dataset: {dataset['name']} ({dataset['row_count']} rows, {dataset['column_count']} columns)
 Constraints: {constraints if constraints else 'none'}
 
 HuggingFace Options: {len(hf_models)} available
-Pre-built Options: {len(prebuilt_models)} available
-
-Analyze and decide:
-1. Best single model to use (provide model_id)
-2. Justification (2-3 sentences)
-3. Confidence score (0-1)
-4. Top 2 alternatives
-5. Next steps (3 action items)
-
-Consider: accuracy, speed, cost, ease of use."""
+Pre-built Options: {len(prebuilt_models)} available"""
 
         try:
-            response = self.model.generate_content(prompt)
+            response_text = await self._generate_cached(self.decision_model, "decision", prompt, 300)
 
             selected_model = hf_models[0] if hf_models else (prebuilt_models[0] if prebuilt_models else None)
 
@@ -160,7 +187,7 @@ Consider: accuracy, speed, cost, ease of use."""
                     "downloads": selected_model.get("downloads", 0),
                     "task": task_type
                 },
-                "reasoning": response.text[:300] if response.text else "Selected based on popularity and task match",
+                "reasoning": response_text[:300] if response_text else "Selected based on popularity and task match",
                 "confidence_score": self._calculate_confidence(selected_model, dataset),
                 "alternatives": [
                     {
@@ -191,23 +218,55 @@ Consider: accuracy, speed, cost, ease of use."""
                 "next_steps": ["Deploy selected model", "Test with sample data", "Monitor performance"]
             }
 
-    def _detect_task_type(self, description: str) -> str:
-        desc_lower = description.lower()
+    async def _generate_cached(
+        self,
+        model: genai.GenerativeModel,
+        kind: str,
+        prompt: str,
+        max_chars: int
+    ) -> str:
+        key = (kind, prompt)
+        cached = self._response_cache.get(key)
+        if cached is not None:
+            self._response_cache.move_to_end(key)
+            return cached
+
+        # Only the first max_chars are used: stream and stop reading once we have them
+        response = await model.generate_content_async(prompt, stream=True)
+        parts = []
+        length = 0
+        try:
+            async for chunk in response:
+                parts.append(stream_chunk_text(chunk))
+                length += len(parts[-1])
+                if length >= max_chars:
+                    break
+        finally:
+            await close_stream(response)
+        text = "".join(parts)[:max_chars]
+        # An empty (e.g. blocked) response is returned but not cached, so the next call retries
+        if text:
+            self._response_cache[key] = text
+            if len(self._response_cache) > self.response_cache_size:
+                self._response_cache.popitem(last=False)
+        return text
+
+    async def _find_dataset(self, dataset_id: Optional[str]) -> Optional[Dict]:
+        if not dataset_id or not ObjectId.is_valid(dataset_id):
+            return None
+        return await mongodb.database["datasets"].find_one({"_id": ObjectId(dataset_id)})
+
+    async def _find_prebuilt_models(self, task_type: str) -> List[Dict]:
+        return await mongodb.database["prebuilt_models"].find({
+            "task_type": task_type
+        }).limit(3).to_list(length=3)
 
-        if any(word in desc_lower for word in ["sentiment", "emotion", "opinion"]):
-            return "text-classification"
-        elif any(word in desc_lower for word in ["summarize", "summary", "summarization"]):
-            return "summarization"
-        elif any(word in desc_lower for word in ["translate", "translation"]):
-            return "translation"
-        elif any(word in desc_lower for word in ["question", "qa", "answer"]):
-            return "question-answering"
-        elif any(word in desc_lower for word in ["classify", "classification", "categorize"]):
-            return "text-classification"
-        elif any(word in desc_lower for word in ["image", "vision", "object detection"]):
-            return "image-classification"
-        else:
+    def _detect_task_type(self, description: str) -> str:
+        # Single scan; the highest-priority group found anywhere wins
+        group = min((m.lastindex for m in TASK_KEYWORDS_RE.finditer(description)), default=None)
+        if group is None:
             return "text-classification"
+        return TASK_TYPES_BY_GROUP[group - 1]
 
     def _format_hf_models(self, models: List[Dict]) -> str:
         return "\n".join([
@@ -230,28 +289,32 @@ Consider: accuracy, speed, cost, ease of use."""
         priority: str
     ) -> List[Dict[str, Any]]:
 
-        recommendations = []
-
-        if priority == "speed" and prebuilt_models:
-            for m in prebuilt_models[:2]:
-                recommendations.append({
+        speed_picks = prebuilt_models[:2] if priority == "speed" else []
+        candidates = itertools.chain(
+            (
+                {
                     "model_id": str(m["_id"]),
                     "name": m["name"],
                     "type": "prebuilt",
                     "score": 0.95,
                     "reason": "Pre-built, instant deployment"
-                })
-
-        for m in hf_models[:3]:
-            recommendations.append({
-                "model_id": m["model_id"],
-                "name": m["name"],
-                "type": "huggingface",
-                "score": min(0.9, m["downloads"] / 1000000),
-                "reason": f"{m['downloads']} downloads, popular choice"
-            })
-
-        return sorted(recommendations, key=lambda x: x["score"], reverse=True)[:3]
+                }
+                for m in speed_picks
+            ),
+            (
+                {
+                    "model_id": m["model_id"],
+                    "name": m["name"],
+                    "type": "huggingface",
+                    "score": min(0.9, m["downloads"] / 1_000_000),
+                    "reason": f"{m['downloads']} downloads, popular choice"
+                }
+                for m in hf_models[:3]
+            )
+        )
+
+        # Top 3 in one pass (stable for equal scores, like the previous sorted()[:3])
+        return heapq.nlargest(3, candidates, key=lambda x: x["score"])
 
     def _estimate_cost(self, task_type: str, budget: Optional[float]) -> float:
         base_costs = {
@@ -5,14 +5,40 @@ Caches trained models locally to avoid downloading from Azure on every predictio
 Significantly improves prediction performance and reduces Azure egress costs.
 """
 
+import io
 import os
 import shutil
+import threading
+import time
+import uuid
 import zipfile
+from collections import OrderedDict
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Iterator, Optional
 import hashlib
 
 
+# Refuse archives whose declared uncompressed size exceeds this (zip bomb guard)
+MAX_EXTRACTED_BYTES = 2 * 1024 * 1024 * 1024
+
+
+def _scandir_files(path) -> Iterator[os.DirEntry]:
+    """
+    Recursively yield regular files under path (symlinks are skipped)
+
+    os.scandir's DirEntry caches the type (and on Windows, stat) from the directory
+    listing, so this avoids the extra stat() calls pathlib.rglob + is_file() make.
+    """
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_symlink():
+                continue
+            if entry.is_file(follow_symlinks=False):
+                yield entry
+            elif entry.is_dir(follow_symlinks=False):
+                yield from _scandir_files(entry.path)
+
+
 class ModelCacheService:
     """Service to manage local model caching"""
 
@@ -28,9 +54,26 @@ class ModelCacheService:
             backend_dir = Path(__file__).parent.parent.parent
             cache_dir = backend_dir / "model_cache"
 
+        # Created on the first cache_model call, so importing this module touches no disk
         self.cache_dir = Path(cache_dir)
-        self.cache_dir.mkdir(parents=True, exist_ok=True)
-        print(f"[MODEL_CACHE] Cache directory: {self.cache_dir}")
+
+        # Resolved (already validated) model paths, LRU-bounded: repeat predictions
+        # for the same model skip the filesystem checks
+        self.path_cache_size = 128
+        self._path_cache: "OrderedDict[tuple, Path]" = OrderedDict()
+
+        # Recent misses (key -> expiry on the monotonic clock), so retry storms for a
+        # model that isn't cached yet don't repeat the filesystem checks
+        self.negative_cache_ttl = 5.0
+        self._neg_cache: Dict[tuple, float] = {}
+        # Predictions look paths up from executor threads; guards both caches above
+        # and the running totals below
+        self._cache_lock = threading.Lock()
+
+        # Running totals for get_cache_stats; None until the first stats call walks
+        # the cache once (and again after anything we can't account for exactly)
+        self._model_count: Optional[int] = None
+        self._total_bytes: Optional[int] = None
 
     def _get_cache_key(self, model_id: str, blob_path: str) -> str:
         """
@@ -43,9 +86,10 @@ class ModelCacheService:
         Returns:
             Cache key (hash of model_id + blob_path)
         """
-        # Use hash to create a filesystem-safe cache key
+        # Use hash to create a filesystem-safe cache key (non-cryptographic use:
+        # BLAKE2b-128 is faster than MD5 and gives the same 32-char hex name)
         key_string = f"{model_id}_{blob_path}"
-        cache_key = hashlib.md5(key_string.encode()).hexdigest()
+        cache_key = hashlib.blake2b(key_string.encode(), digest_size=16).hexdigest()
         return cache_key
 
     def get_cached_model_path(self, model_id: str, blob_path: str) -> Optional[Path]:
@@ -59,21 +103,46 @@ class ModelCacheService:
         Returns:
             Path to cached model directory if exists, None otherwise
         """
+        key = (model_id, blob_path)
+        with self._cache_lock:
+            cache_path = self._path_cache.get(key)
+            if cache_path is not None:
+                self._path_cache.move_to_end(key)
+
+        # One stat re-validates a remembered path, so a directory removed out of band
+        # falls through to the checks below instead of failing every prediction
+        if cache_path is not None:
+            if cache_path.exists():
+                return cache_path
+            with self._cache_lock:
+                self._path_cache.pop(key, None)
+
+        with self._cache_lock:
+            expires = self._neg_cache.get(key)
+            if expires is not None:
+                if expires > time.monotonic():
+                    return None
+                self._neg_cache.pop(key, None)
+
         cache_key = self._get_cache_key(model_id, blob_path)
         cache_path = self.cache_dir / cache_key / "model_files"
 
         if cache_path.exists():
-            # Verify the model directory is valid
-            if (cache_path / "predictor.pkl").exists() or list(cache_path.glob("*.pkl")):
+            # Verify the model directory is valid (predictor.pkl is the common case;
+            # only fall back to scanning for any pickle when it's missing)
+            if (cache_path / "predictor.pkl").exists() or next(cache_path.glob("*.pkl"), None):
                 print(f"[MODEL_CACHE] HIT: Found cached model at {cache_path}")
+                self._remember_path(key, cache_path)
                 return cache_path
             else:
                 print(f"[MODEL_CACHE] INVALID: Cache exists but no model files found, removing")
                 # Remove invalid cache
                 shutil.rmtree(cache_path.parent)
+                self._reset_stats()
                 return None
         else:
             print(f"[MODEL_CACHE] MISS: Model not in cache")
+            self._remember_miss(key)
             return None
 
     def cache_model(
@@ -93,41 +162,98 @@ class ModelCacheService:
         Returns:
             Path to the cached model directory
         """
+        with self._cache_lock:
+            self._path_cache.pop((model_id, blob_path), None)
+            self._neg_cache.pop((model_id, blob_path), None)
         cache_key = self._get_cache_key(model_id, blob_path)
         cache_base_path = self.cache_dir / cache_key
         cache_model_path = cache_base_path / "model_files"
 
-        # Create cache directory
-        cache_base_path.mkdir(parents=True, exist_ok=True)
+        # Re-caching over an existing entry changes sizes we haven't tracked
+        if cache_base_path.exists():
+            self._reset_stats()
 
-        # Save zip file temporarily
-        zip_path = cache_base_path / "model.zip"
+        # Create cache directory (and the cache root on first use)
+        if not self.cache_dir.exists():
+            print(f"[MODEL_CACHE] Cache directory: {self.cache_dir}")
+        cache_base_path.mkdir(parents=True, exist_ok=True)
 
+        tmp_path = None
         try:
             print(f"[MODEL_CACHE] Caching model...")
 
-            # Write zip file
-            with open(zip_path, 'wb') as f:
-                f.write(model_zip_bytes)
-
-            # Extract model
-            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                zip_ref.extractall(cache_model_path)
-
-            # Remove zip file (keep only extracted model)
-            zip_path.unlink()
-
+            # Extract straight from memory (no temporary zip on disk); extractall
+            # streams each member and sanitizes paths. Only real files are written:
+            # directory entries (parents are created anyway) and macOS junk are skipped.
+            with zipfile.ZipFile(io.BytesIO(model_zip_bytes), 'r') as zip_ref:
+                members = [
+                    member for member in zip_ref.infolist()
+                    if not member.is_dir()
+                    and not member.filename.startswith("__MACOSX/")
+                    and not member.filename.endswith(".DS_Store")
+                ]
+                extracted_bytes = sum(member.file_size for member in members)
+                if extracted_bytes > MAX_EXTRACTED_BYTES:
+                    raise ValueError(
+                        f"Model archive expands to {extracted_bytes / 1024 / 1024:.0f} MB, "
+                        f"over the {MAX_EXTRACTED_BYTES / 1024 / 1024:.0f} MB limit"
+                    )
+                # Extract beside the final directory and swap it in with one rename, so
+                # a crash mid-extract never leaves a half-populated model_files behind
+                tmp_path = cache_base_path / f".tmp_{os.getpid()}_{uuid.uuid4().hex}"
+                zip_ref.extractall(tmp_path, members=members)
+
+            # First writer wins: a concurrent cold prediction may already have cached
+            # this model and be loading it, so never replace an existing model_files
+            try:
+                if cache_model_path.exists():
+                    raise FileExistsError(cache_model_path)
+                os.rename(tmp_path, cache_model_path)
+            except OSError:
+                if not cache_model_path.exists():
+                    raise
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                print(f"[MODEL_CACHE] Model already cached at {cache_model_path}, keeping it")
+                self._remember_path((model_id, blob_path), cache_model_path)
+                return cache_model_path
+
+            self._remember_path((model_id, blob_path), cache_model_path)
+            # The central directory already lists every extracted file's size
+            model_size = extracted_bytes
+            with self._cache_lock:
+                if self._model_count is not None:
+                    self._model_count += 1
+                    self._total_bytes += model_size
             print(f"[MODEL_CACHE] Cached model at {cache_model_path}")
-            print(f"[MODEL_CACHE] Cache size: {self._get_dir_size(cache_model_path) / 1024 / 1024:.2f} MB")
+            print(f"[MODEL_CACHE] Cache size: {model_size / 1024 / 1024:.2f} MB")
 
             return cache_model_path
 
         except Exception as e:
-            # Clean up on error
-            if cache_base_path.exists():
-                shutil.rmtree(cache_base_path)
+            # Clean up on error; a previously cached copy (if any) is left intact
+            if tmp_path is not None:
+                shutil.rmtree(tmp_path, ignore_errors=True)
+            if not cache_model_path.exists():
+                shutil.rmtree(cache_base_path, ignore_errors=True)
+            self._reset_stats()
             raise Exception(f"Failed to cache model: {str(e)}")
 
+    def _remember_path(self, key: tuple, path: Path):
+        """Record a validated model path, evicting the least recently used when full"""
+        with self._cache_lock:
+            self._path_cache[key] = path
+            self._path_cache.move_to_end(key)
+            if len(self._path_cache) > self.path_cache_size:
+                self._path_cache.popitem(last=False)
+
+    def _remember_miss(self, key: tuple):
+        """Record a miss for negative_cache_ttl seconds, dropping expired entries when it grows"""
+        now = time.monotonic()
+        with self._cache_lock:
+            if len(self._neg_cache) >= self.path_cache_size:
+                self._neg_cache = {k: t for k, t in self._neg_cache.items() if t > now}
+            self._neg_cache[key] = now + self.negative_cache_ttl
+
     def clear_cache(self, model_id: Optional[str] = None, blob_path: Optional[str] = None):
         """
         Clear cached models
@@ -138,10 +264,17 @@ class ModelCacheService:
         """
         if model_id and blob_path:
             # Clear specific model
+            with self._cache_lock:
+                self._path_cache.pop((model_id, blob_path), None)
             cache_key = self._get_cache_key(model_id, blob_path)
             cache_path = self.cache_dir / cache_key
 
             if cache_path.exists():
+                freed_bytes = self._get_dir_size(cache_path)
+                with self._cache_lock:
+                    if self._model_count is not None:
+                        self._model_count -= 1
+                        self._total_bytes -= freed_bytes
                 shutil.rmtree(cache_path)
                 print(f"[MODEL_CACHE] Cleared cache for model {model_id}")
             else:
@@ -149,10 +282,24 @@ class ModelCacheService:
 
         else:
             # Clear all cache
+            with self._cache_lock:
+                self._path_cache.clear()
             if self.cache_dir.exists():
-                shutil.rmtree(self.cache_dir)
+                # Swap in an empty directory with one rename and delete the old tree in
+                # the background, so the request doesn't wait on unlinking every file
+                trash = self.cache_dir.with_name(f"{self.cache_dir.name}.trash_{uuid.uuid4().hex}")
+                os.rename(self.cache_dir, trash)
                 self.cache_dir.mkdir(parents=True, exist_ok=True)
+                threading.Thread(
+                    target=shutil.rmtree,
+                    args=(trash,),
+                    kwargs={"ignore_errors": True},
+                    daemon=True
+                ).start()
                 print(f"[MODEL_CACHE] Cleared all cached models")
+            with self._cache_lock:
+                self._model_count = 0
+                self._total_bytes = 0
 
     def get_cache_stats(self) -> dict:
         """
@@ -168,15 +315,29 @@ class ModelCacheService:
                 "cache_dir": str(self.cache_dir)
             }
 
-        total_models = len(list(self.cache_dir.iterdir()))
-        total_size = self._get_dir_size(self.cache_dir)
+        with self._cache_lock:
+            model_count, total_bytes = self._model_count, self._total_bytes
+
+        if model_count is None:
+            # First call (or after an untracked change): walk the cache once (outside
+            # the lock, so predictions aren't held up by the walk)
+            model_count = len(list(self.cache_dir.iterdir()))
+            total_bytes = self._get_dir_size(self.cache_dir)
+            with self._cache_lock:
+                self._model_count, self._total_bytes = model_count, total_bytes
 
         return {
-            "total_models": total_models,
-            "total_size_mb": round(total_size / 1024 / 1024, 2),
+            "total_models": model_count,
+            "total_size_mb": round(total_bytes / 1024 / 1024, 2),
             "cache_dir": str(self.cache_dir)
         }
 
+    def _reset_stats(self):
+        """Forget the running totals so the next get_cache_stats call re-walks the cache"""
+        with self._cache_lock:
+            self._model_count = None
+            self._total_bytes = None
+
     def _get_dir_size(self, path: Path) -> int:
         """
         Get total size of a directory in bytes
@@ -187,11 +348,7 @@ class ModelCacheService:
         Returns:
             Total size in bytes
         """
-        total = 0
-        for entry in path.rglob('*'):
-            if entry.is_file():
-                total += entry.stat().st_size
-        return total
+        return sum(entry.stat(follow_symlinks=False).st_size for entry in _scandir_files(path))
 
 
 # Global instance
@@ -3,41 +3,174 @@ Razorpay Payment Gateway Service
 Handles payment processing, order creation, and subscription management
 """
 import razorpay
+import asyncio
+import base64
 import hmac
 import hashlib
-from typing import Optional, Dict, Any
+import time
+import traceback
+from typing import Optional, Dict, Any, List, Set, Tuple
 from datetime import datetime, timedelta
 from app.core.config import settings
 from bson import ObjectId
+from pymongo import IndexModel, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from app.mongodb import mongodb
-from app.models.mongodb_models import Payment, Subscription, Plan, UsageRecord
+from app.models.mongodb_models import Subscription, Plan, UsageRecord, WebhookEvent
+from app.services.dunning_service import dunning_service
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Innermost stack frames kept in a failed webhook_events document (deep async stacks would
+# otherwise bloat every failed event)
+WEBHOOK_TRACEBACK_FRAMES = 10
+
+# A webhook still "processing" this long after it was claimed is assumed abandoned (its
+# process stopped mid-handler) and may be claimed again by recover_webhooks
+WEBHOOK_PROCESSING_LEASE = timedelta(minutes=10)
+
+# A webhook still "pending" this long after it was stored missed its queue (process
+# stopped, or it failed before being claimed) and is re-queued by the recovery sweep
+WEBHOOK_PENDING_GRACE = timedelta(minutes=1)
+
 
 class PaymentService:
     """Handle Razorpay payment operations"""
 
     def __init__(self):
+        # Plans rarely change: keep parsed documents for plan_cache_ttl seconds so
+        # order creation, payment processing and webhooks skip the lookup
+        self.plan_cache_ttl = 60.0
+        self._plan_cache: Dict[str, Tuple[Plan, float]] = {}
+
+        # Fire-and-forget tasks, referenced until done so they aren't garbage collected
+        self._background_tasks: Set[asyncio.Task] = set()
+
+        # Webhooks are acknowledged once queued and processed by a small worker pool
+        # (started and stopped with the app)
+        self.webhook_worker_count = 4
+        self._webhook_queue: Optional[asyncio.Queue] = None
+        self._webhook_workers: List[asyncio.Task] = []
+        # Periodic recover_webhooks sweep, run alongside the workers
+        self.webhook_recovery_interval = 300.0
+        self._webhook_recovery_task: Optional[asyncio.Task] = None
+
+        # Webhook event type -> handler
+        self._webhook_handlers = {
+            "payment.captured": self._handle_payment_captured,
+            "payment.failed": self._handle_payment_failed,
+            "subscription.charged": self._handle_subscription_charged,
+            "subscription.cancelled": self._handle_subscription_cancelled,
+            "subscription.paused": self._handle_subscription_paused,
+            "subscription.resumed": self._handle_subscription_resumed
+        }
+
         self.client = None
         if settings.RAZORPAY_KEY_ID and settings.RAZORPAY_KEY_SECRET:
             self.client = razorpay.Client(
                 auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET)
             )
+            # Keyed HMAC computed once; each verification copies it instead of
+            # re-deriving the padded key state
+            self._hmac_template = hmac.new(
+                settings.RAZORPAY_KEY_SECRET.encode(), digestmod=hashlib.sha256
+            )
             logger.info("Razorpay client initialized")
         else:
             logger.warning("Razorpay credentials not configured")
+        # Fixed for the process lifetime; checked first on every order/verification
+        self._configured = self.client is not None
+
+    async def ensure_indexes(self):
+        """
+        Create the indexes behind the payment and webhook lookups
+
+        Mirrors the specs in scripts/init_subscription_plans.py (identical specs are a
+        no-op there), so deployments that never ran the script don't fall back to
+        collection scans on every webhook.
+        """
+        indexes = {
+            # Idempotency check
+            "webhook_events": [IndexModel("event_id", unique=True)],
+            # Webhook handlers look payments up by Razorpay IDs
+            "payments": [IndexModel("razorpay_payment_id"), IndexModel("razorpay_order_id")],
+            "subscriptions": [
+                IndexModel("razorpay_subscription_id"),
+                IndexModel([("user_id", 1), ("status", 1)])
+            ],
+            "usage_records": [IndexModel("user_id", unique=True)]
+        }
+        results = await asyncio.gather(
+            *(mongodb.database[name].create_indexes(models) for name, models in indexes.items()),
+            return_exceptions=True
+        )
+        for name, result in zip(indexes, results):
+            # Events stored before the unique index existed may repeat an event_id, which
+            # makes building it fail: dedupe once and retry (only then, not on every boot)
+            if name == "webhook_events" and isinstance(result, DuplicateKeyError):
+                try:
+                    await self._dedupe_webhook_events()
+                    await mongodb.database[name].create_indexes(indexes[name])
+                    continue
+                except Exception as e:
+                    result = e
+            if isinstance(result, Exception):
+                logger.warning(f"Could not ensure {name} indexes: {str(result)}")
+
+    async def _dedupe_webhook_events(self):
+        """
+        Keep one webhook_events document per event_id (a processed one when there is one)
+
+        The others stay for the audit trail: they are marked "duplicate", with their
+        event_id moved to original_event_id (and made unique) so the index can build.
+        """
+        collection = mongodb.database["webhook_events"]
+        groups = await collection.aggregate([
+            {"$group": {
+                "_id": "$event_id",
+                "docs": {"$push": {"_id": "$_id", "status": "$status"}},
+                "count": {"$sum": 1}
+            }},
+            {"$match": {"count": {"$gt": 1}}}
+        ]).to_list(None)
+
+        duplicate_ids = []
+        for group in groups:
+            docs = group["docs"]
+            keep = next((doc for doc in docs if doc.get("status") == "processed"), docs[0])
+            duplicate_ids.extend(doc["_id"] for doc in docs if doc is not keep)
+
+        if duplicate_ids:
+            result = await collection.update_many(
+                {"_id": {"$in": duplicate_ids}},
+                [{"$set": {
+                    "original_event_id": "$event_id",
+                    "event_id": {"$concat": ["$event_id", ":duplicate:", {"$toString": "$_id"}]},
+                    "status": "duplicate",
+                    "updated_at": datetime.utcnow()
+                }}]
+            )
+            logger.warning(
+                f"Marked {result.modified_count} duplicate webhook_events documents: "
+                f"{', '.join(str(_id) for _id in duplicate_ids)}"
+            )
 
     def is_configured(self) -> bool:
         """Check if Razorpay is properly configured"""
-        return self.client is not None
+        return self._configured
 
     async def get_plan_details(self, plan_name: str) -> Optional[Plan]:
-        """Get plan details from database"""
+        """Get plan details from database (cached for plan_cache_ttl seconds)"""
+        cached = self._plan_cache.get(plan_name)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+
         plan_doc = await mongodb.database["plans"].find_one({"plan": plan_name})
         if plan_doc:
-            return Plan(**plan_doc)
+            plan = Plan(**plan_doc)
+            self._plan_cache[plan_name] = (plan, time.monotonic() + self.plan_cache_ttl)
+            return plan
         return None
 
     async def create_order(
@@ -49,7 +182,7 @@ class PaymentService:
         Create a Razorpay order for one-time payment
         Returns order details for frontend integration
         """
-        if not self.is_configured():
+        if not self._configured:
             raise Exception("Razorpay not configured")
 
         # Get plan details
@@ -62,9 +195,14 @@ class PaymentService:
 
         # Create Razorpay order
         amount_paise = int(plan.price_monthly * 100)  # Convert to paise
-        # Receipt must be <= 40 chars. Use last 12 chars of user_id + timestamp
-        timestamp = int(datetime.utcnow().timestamp())
-        receipt = f"ord_{str(user_id)[-12:]}_{timestamp}"
+        # Receipt must be <= 40 chars: a 15-byte BLAKE2s of the user id and a ns
+        # timestamp, base32-encoded (24 chars, no padding), so two orders in the same
+        # second no longer share a receipt
+        digest = hashlib.blake2s(
+            ObjectId(user_id).binary + time.time_ns().to_bytes(8, "big"),
+            digest_size=15
+        ).digest()
+        receipt = "ord_" + base64.b32encode(digest).decode()
         order_data = {
             "amount": amount_paise,
             "currency": plan.currency,
@@ -77,7 +215,8 @@ class PaymentService:
         }
 
         try:
-            razorpay_order = self.client.order.create(data=order_data)
+            # The Razorpay SDK is synchronous (requests); keep it off the event loop
+            razorpay_order = await asyncio.to_thread(self.client.order.create, data=order_data)
             logger.info(f"Razorpay order created: {razorpay_order['id']} for user {user_id}")
 
             return {
@@ -102,19 +241,17 @@ class PaymentService:
         Verify Razorpay payment signature
         Returns True if signature is valid
         """
-        if not self.is_configured():
+        if not self._configured:
             return False
 
         try:
             # Generate expected signature
-            message = f"{order_id}|{payment_id}"
-            expected_signature = hmac.new(
-                settings.RAZORPAY_KEY_SECRET.encode(),
-                message.encode(),
-                hashlib.sha256
-            ).hexdigest()
-
-            return hmac.compare_digest(expected_signature, signature)
+            mac = self._hmac_template.copy()
+            mac.update(b"|".join((order_id.encode(), payment_id.encode())))
+
+            # Compare the raw 32-byte digests (a malformed hex signature raises and
+            # is rejected below)
+            return hmac.compare_digest(mac.digest(), bytes.fromhex(signature))
         except Exception as e:
             logger.error(f"Signature verification failed: {str(e)}")
             return False
@@ -140,26 +277,31 @@ class PaymentService:
 
         # Fetch payment details from Razorpay
         try:
-            payment_details = self.client.payment.fetch(razorpay_payment_id)
+            payment_details = await asyncio.to_thread(self.client.payment.fetch, razorpay_payment_id)
             logger.info(f"Payment verified: {razorpay_payment_id}")
         except Exception as e:
             logger.error(f"Failed to fetch payment details: {str(e)}")
             raise Exception("Payment verification failed")
 
-        # Get plan details
-        plan = await self.get_plan_details(plan_name)
+        # Plan, current subscription and the user (for the emails below)
+        # are independent lookups: fetch them in one round of concurrent queries
+        plan, existing_sub, user = await asyncio.gather(
+            self.get_plan_details(plan_name),
+            mongodb.database["subscriptions"].find_one(
+                {"user_id": user_id, "status": {"$in": ["active", "past_due"]}}
+            ),
+            mongodb.database["users"].find_one(
+                {"_id": user_id}, {"email": 1, "full_name": 1, "username": 1}
+            )
+        )
         if not plan:
             raise Exception(f"Plan '{plan_name}' not found")
 
         # Calculate billing period (monthly)
-        period_start = datetime.utcnow()
+        now = datetime.utcnow()
+        period_start = now
         period_end = period_start + timedelta(days=30)
 
-        # Check if user already has a subscription
-        existing_sub = await mongodb.database["subscriptions"].find_one(
-            {"user_id": user_id, "status": {"$in": ["active", "past_due"]}}
-        )
-
         if existing_sub:
             # Update existing subscription
             subscription_id = existing_sub["_id"]
@@ -172,16 +314,15 @@ class PaymentService:
                         "period_start": period_start,
                         "period_end": period_end,
                         "amount": plan.price_monthly,
-                        "last_payment_at": datetime.utcnow(),
+                        "last_payment_at": now,
                         "next_billing_date": period_end,
                         "razorpay_plan_id": plan.razorpay_plan_id,
                         "cancel_at_period_end": False,
                         "canceled_at": None,
-                        "updated_at": datetime.utcnow()
+                        "updated_at": now
                     }
                 }
             )
-            logger.info(f"Updated subscription {subscription_id} for user {user_id}")
         else:
             # Create new subscription
             subscription = Subscription(
@@ -193,89 +334,98 @@ class PaymentService:
                 period_end=period_end,
                 amount=plan.price_monthly,
                 currency=plan.currency,
-                last_payment_at=datetime.utcnow(),
+                last_payment_at=now,
                 next_billing_date=period_end,
                 razorpay_plan_id=plan.razorpay_plan_id
             )
             result = await mongodb.database["subscriptions"].insert_one(
-                subscription.dict(by_alias=True)
+                subscription.model_dump(by_alias=True)
             )
             subscription_id = result.inserted_id
-            logger.info(f"Created subscription {subscription_id} for user {user_id}")
 
         # Update user's current_plan and subscription_id
-        await mongodb.database["users"].update_one(
+        user_write = mongodb.database["users"].update_one(
             {"_id": user_id},
             {
                 "$set": {
                     "current_plan": plan_name,
                     "subscription_id": subscription_id,
-                    "updated_at": datetime.utcnow()
+                    "updated_at": now
                 }
             }
         )
 
-        # Create or update usage record (search by user_id only since it's unique)
-        usage_record = await mongodb.database["usage_records"].find_one(
-            {"user_id": user_id}
+        # Create or reset the usage record in one atomic upsert (user_id is unique):
+        # point it at the new subscription and reset usage, filling in the remaining
+        # defaults only when the user has no record yet
+        usage_reset = {
+            "subscription_id": subscription_id,
+            "api_hits_used": 0,
+            "models_trained_today": 0,
+            "billing_cycle_start": period_start,
+            "billing_cycle_end": period_end,
+            "last_reset_at": now,
+            "updated_at": now
+        }
+        new_usage = UsageRecord(
+            user_id=user_id,
+            billing_cycle_end=period_end
+        ).model_dump(by_alias=True)
+        for field in usage_reset:
+            new_usage.pop(field, None)
+        new_usage.pop("user_id")
+        usage_write = mongodb.database["usage_records"].update_one(
+            {"user_id": user_id},
+            {"$set": usage_reset, "$setOnInsert": new_usage},
+            upsert=True
         )
 
-        if not usage_record:
-            # Create new usage record for new user
-            new_usage = UsageRecord(
-                user_id=user_id,
-                subscription_id=subscription_id,
-                api_hits_used=0,
-                models_trained_today=0,
-                azure_storage_used_mb=0.0,
-                billing_cycle_start=period_start,
-                billing_cycle_end=period_end
-            )
-            await mongodb.database["usage_records"].insert_one(
-                new_usage.dict(by_alias=True)
-            )
-            logger.info(f"Created usage record for user {user_id}")
-        else:
-            # Update existing usage record with new subscription and reset usage
-            await mongodb.database["usage_records"].update_one(
-                {"_id": usage_record["_id"]},
-                {
-                    "$set": {
-                        "subscription_id": subscription_id,
-                        "api_hits_used": 0,
-                        "models_trained_today": 0,
-                        "billing_cycle_start": period_start,
-                        "billing_cycle_end": period_end,
-                        "last_reset_at": datetime.utcnow(),
-                        "updated_at": datetime.utcnow()
-                    }
-                }
-            )
-            logger.info(f"Updated usage record for user {user_id} with new subscription {subscription_id}")
+        # Record payment transaction. Every value here is server-side (plan, verified
+        # Razorpay IDs), so the document is built directly in the Payment model's
+        # shape instead of validating and re-serializing a model instance.
+        payment_doc = {
+            "_id": ObjectId(),
+            "user_id": user_id,
+            "subscription_id": subscription_id,
+            "amount": plan.price_monthly,
+            "currency": plan.currency,
+            "status": "success",
+            "payment_method": payment_details.get("method") or "unknown",
+            "razorpay_payment_id": razorpay_payment_id,
+            "razorpay_order_id": razorpay_order_id,
+            "razorpay_signature": razorpay_signature,
+            "promo_code_id": None,
+            "promo_code": None,
+            "discount_applied": 0.0,
+            "original_amount": None,
+            "addon_id": None,
+            "payment_type": "subscription",
+            "description": f"Subscription: {plan.name}",
+            "failure_reason": None,
+            "refund_amount": None,
+            "refunded_at": None,
+            "created_at": now,
+            "updated_at": now
+        }
+        payment_write = mongodb.database["payments"].insert_one(payment_doc)
 
-        # Record payment transaction
-        payment_record = Payment(
-            user_id=user_id,
-            subscription_id=subscription_id,
-            amount=plan.price_monthly,
-            currency=plan.currency,
-            status="success",
-            payment_method=payment_details.get("method", "unknown"),
-            razorpay_payment_id=razorpay_payment_id,
-            razorpay_order_id=razorpay_order_id,
-            razorpay_signature=razorpay_signature,
-            description=f"Subscription: {plan.name}"
+        # The subscription is written first (above) so these never reference one that
+        # failed to save; they target different collections and don't depend on each
+        # other, so they go out concurrently
+        _, usage_result, _ = await asyncio.gather(user_write, usage_write, payment_write)
+
+        logger.info(
+            f"{'Updated' if existing_sub else 'Created'} subscription {subscription_id} for user {user_id}"
         )
-        await mongodb.database["payments"].insert_one(
-            payment_record.dict(by_alias=True)
+        logger.info(
+            f"{'Created' if usage_result.upserted_id else 'Updated'} usage record for user {user_id} "
+            f"with subscription {subscription_id}"
         )
 
         # Send subscription confirmation email
         try:
             from app.services.email_service import email_service
 
-            # Get user details for email
-            user = await mongodb.database["users"].find_one({"_id": user_id})
             if user and user.get("email"):
                 user_email = user["email"]
                 user_name = user.get("full_name") or user.get("username") or "User"
@@ -290,7 +440,7 @@ class PaymentService:
                     amount=plan.price_monthly,
                     currency=plan.currency,
                     payment_id=razorpay_payment_id,
-                    payment_date=datetime.utcnow(),
+                    payment_date=now,
                     next_billing_date=period_end
                 )
 
@@ -340,16 +490,17 @@ class PaymentService:
         if not subscription:
             raise Exception("No active subscription found")
 
+        now = datetime.utcnow()
         update_data = {
             "cancel_at_period_end": cancel_at_period_end,
-            "canceled_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow()
+            "canceled_at": now,
+            "updated_at": now
         }
 
         if not cancel_at_period_end:
             # Cancel immediately
             update_data["status"] = "canceled"
-            update_data["period_end"] = datetime.utcnow()
+            update_data["period_end"] = now
 
             # Downgrade user to free plan
             await mongodb.database["users"].update_one(
@@ -357,7 +508,7 @@ class PaymentService:
                 {
                     "$set": {
                         "current_plan": "free",
-                        "updated_at": datetime.utcnow()
+                        "updated_at": now
                     }
                 }
             )
@@ -376,6 +527,168 @@ class PaymentService:
             "period_end": subscription["period_end"]
         }
 
+    def start_webhook_workers(self):
+        """Start the webhook worker pool and the recovery sweep (call from app startup)"""
+        if self._webhook_workers:
+            return
+        self._webhook_queue = asyncio.Queue()
+        self._webhook_workers = [
+            asyncio.create_task(self._drain_webhooks())
+            for _ in range(self.webhook_worker_count)
+        ]
+        self._webhook_recovery_task = asyncio.create_task(self._recover_webhooks_periodically())
+
+    async def _recover_webhooks_periodically(self):
+        """Run recover_webhooks now and every webhook_recovery_interval seconds"""
+        while True:
+            try:
+                await self.recover_webhooks()
+            except Exception as e:
+                logger.error(f"Webhook recovery failed: {str(e)}")
+            await asyncio.sleep(self.webhook_recovery_interval)
+
+    async def stop_webhook_workers(self, timeout: float = 10.0):
+        """Finish queued webhooks (up to timeout seconds), then stop the workers"""
+        if not self._webhook_workers:
+            return
+        if self._webhook_recovery_task is not None:
+            self._webhook_recovery_task.cancel()
+            await asyncio.gather(self._webhook_recovery_task, return_exceptions=True)
+            self._webhook_recovery_task = None
+        try:
+            await asyncio.wait_for(self._webhook_queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"{self._webhook_queue.qsize()} queued webhooks not processed before shutdown")
+        for worker in self._webhook_workers:
+            worker.cancel()
+        await asyncio.gather(*self._webhook_workers, return_exceptions=True)
+        self._webhook_workers = []
+        self._webhook_queue = None
+
+    async def _drain_webhooks(self):
+        while True:
+            webhook = await self._webhook_queue.get()
+            try:
+                await self.handle_webhook(**webhook)
+            except Exception as e:
+                logger.error(f"Queued webhook processing failed: {str(e)}")
+            finally:
+                self._webhook_queue.task_done()
+
+    async def enqueue_webhook(
+        self,
+        event: str,
+        payload: Dict[str, Any],
+        event_id: Optional[str] = None,
+        source_ip: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Persist a webhook, queue it for the worker pool and acknowledge it
+
+        Razorpay only needs a quick 2xx, but it must not get one before the event is
+        stored: the pending webhook_events document is what recover_webhooks re-queues
+        if the process stops first. A failed write raises, so Razorpay retries. Falls
+        back to inline processing when the workers aren't running.
+        """
+        if not event_id:
+            event_id = self._webhook_event_id(payload)
+
+        webhook_event = WebhookEvent(
+            event_id=event_id,
+            event_type=event,
+            payload=payload,
+            source_ip=source_ip
+        ).model_dump(by_alias=True)
+
+        try:
+            # The document as it was before this delivery: None when this call stored it
+            existing = await mongodb.database["webhook_events"].find_one_and_update(
+                {"event_id": event_id},
+                {"$setOnInsert": webhook_event},
+                projection={"status": 1},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+        except DuplicateKeyError:
+            # A concurrent delivery of the same event stored (and queued) it first
+            existing = {"status": "pending"}
+
+        status = existing.get("status") if existing else None
+        if status == "processed":
+            logger.info(f"Event {event_id} already processed, skipping")
+            return {
+                "success": True,
+                "message": "Event already processed",
+                "idempotent": True
+            }
+
+        # Only a newly stored or previously failed event is (re)run; a pending or
+        # processing one is already queued or running elsewhere
+        if existing is None or status == "failed":
+            webhook = {"event": event, "payload": payload, "event_id": event_id, "source_ip": source_ip}
+            if not self._webhook_workers:
+                return await self.handle_webhook(**webhook)
+            self._webhook_queue.put_nowait(webhook)
+
+        return {
+            "success": True,
+            "queued": True,
+            "event_id": event_id
+        }
+
+    async def recover_webhooks(self):
+        """
+        Re-queue webhooks stored but never processed (run periodically by the worker pool)
+
+        Pending events older than WEBHOOK_PENDING_GRACE are queued as-is (handle_webhook's
+        claim lets only one run win). Processing events are taken over only once their
+        lease has expired, by resetting them to pending first so a handler that is still
+        running elsewhere keeps its claim.
+        """
+        collection = mongodb.database["webhook_events"]
+        now = datetime.utcnow()
+        lease_cutoff = now - WEBHOOK_PROCESSING_LEASE
+        cursor = collection.find(
+            {"$or": [
+                {"status": "pending", "updated_at": {"$lt": now - WEBHOOK_PENDING_GRACE}},
+                {"status": "processing", "processing_started_at": {"$not": {"$gte": lease_cutoff}}}
+            ]},
+            {"event_id": 1, "event_type": 1, "payload": 1, "source_ip": 1, "status": 1}
+        )
+        recovered = 0
+        async for doc in cursor:
+            if doc["status"] == "processing":
+                result = await collection.update_one(
+                    {
+                        "_id": doc["_id"],
+                        "status": "processing",
+                        "processing_started_at": {"$not": {"$gte": lease_cutoff}}
+                    },
+                    {"$set": {"status": "pending", "updated_at": datetime.utcnow()}}
+                )
+                if not result.modified_count:
+                    continue
+
+            webhook = {
+                "event": doc["event_type"],
+                "payload": doc["payload"],
+                "event_id": doc["event_id"],
+                "source_ip": doc.get("source_ip")
+            }
+            if self._webhook_workers:
+                self._webhook_queue.put_nowait(webhook)
+            else:
+                await self.handle_webhook(**webhook)
+            recovered += 1
+
+        if recovered:
+            logger.info(f"Recovered {recovered} unprocessed webhooks")
+
+    @staticmethod
+    def _webhook_event_id(payload: Dict[str, Any]) -> str:
+        """Razorpay's event id from the payload, or a generated one"""
+        return payload.get("event", {}).get("id") or payload.get("id") or f"event_{datetime.utcnow().timestamp()}"
+
     async def handle_webhook(
         self,
         event: str,
@@ -400,68 +713,49 @@ class PaymentService:
         - Error handling with retry support
         - Dunning integration for failed payments
         """
-        from app.models.mongodb_models import WebhookEvent
-        from app.services.dunning_service import dunning_service
-
         logger.info(f"Processing webhook: {event}")
 
         # Extract event_id from payload if not provided
         if not event_id:
-            event_id = payload.get("event", {}).get("id") or payload.get("id") or f"event_{datetime.utcnow().timestamp()}"
+            event_id = self._webhook_event_id(payload)
 
+        webhook_event_id = None
         try:
-            # Step 1: Check if event already processed (idempotency)
-            existing_event = await mongodb.database["webhook_events"].find_one(
-                {"event_id": event_id}
+            # Step 1: Claim the stored event (enqueue_webhook, recover_webhooks and the
+            # admin retry persist it first). Only a pending or failed event can be
+            # claimed, and no upsert is done, so an event that is processed or already
+            # being processed is skipped even where the unique event_id index is missing.
+            now = datetime.utcnow()
+            event_doc = await mongodb.database["webhook_events"].find_one_and_update(
+                {"event_id": event_id, "status": {"$in": ["pending", "failed"]}},
+                {
+                    "$set": {"status": "processing", "processing_started_at": now, "updated_at": now},
+                    "$inc": {"processing_attempts": 1}
+                },
+                projection={"_id": 1},
+                return_document=ReturnDocument.AFTER
             )
-
-            if existing_event and existing_event["status"] == "processed":
-                logger.info(f"Event {event_id} already processed, skipping")
+            if event_doc is None:
+                logger.info(f"Event {event_id} already processed, in progress or not stored, skipping")
                 return {
                     "success": True,
-                    "message": "Event already processed",
+                    "message": "Event already processed or in progress",
                     "idempotent": True
                 }
+            webhook_event_id = event_doc["_id"]
 
-            # Step 2: Log webhook event to database
-            webhook_event_id = None
-            if not existing_event:
-                webhook_event = WebhookEvent(
-                    event_id=event_id,
-                    event_type=event,
-                    payload=payload,
-                    status="processing",
-                    source_ip=source_ip
-                )
-                result = await mongodb.database["webhook_events"].insert_one(
-                    webhook_event.dict(by_alias=True)
-                )
-                webhook_event_id = result.inserted_id
-            else:
-                webhook_event_id = existing_event["_id"]
-                # Update to processing
-                await mongodb.database["webhook_events"].update_one(
-                    {"_id": webhook_event_id},
-                    {
-                        "$set": {
-                            "status": "processing",
-                            "processing_attempts": existing_event.get("processing_attempts", 0) + 1,
-                            "updated_at": datetime.utcnow()
-                        }
-                    }
-                )
-
-            # Step 3: Process event based on type
+            # Step 2: Process event based on type
             result = await self._process_webhook_event(event, payload)
 
-            # Step 4: Mark event as processed
+            # Step 3: Mark event as processed
+            now = datetime.utcnow()
             await mongodb.database["webhook_events"].update_one(
                 {"_id": webhook_event_id},
                 {
                     "$set": {
                         "status": "processed",
-                        "processed_at": datetime.utcnow(),
-                        "updated_at": datetime.utcnow()
+                        "processed_at": now,
+                        "updated_at": now
                     }
                 }
             )
@@ -476,20 +770,12 @@ class PaymentService:
         except Exception as e:
             logger.error(f"Webhook processing failed: {str(e)}")
 
-            # Mark event as failed
+            # Mark event as failed in the background: formatting the stack and the
+            # write shouldn't delay the response to Razorpay (failures come in bursts)
             if webhook_event_id:
-                import traceback
-                await mongodb.database["webhook_events"].update_one(
-                    {"_id": webhook_event_id},
-                    {
-                        "$set": {
-                            "status": "failed",
-                            "error_message": str(e),
-                            "error_stack": traceback.format_exc(),
-                            "updated_at": datetime.utcnow()
-                        }
-                    }
-                )
+                task = asyncio.create_task(self._record_webhook_failure(webhook_event_id, e))
+                self._background_tasks.add(task)
+                task.add_done_callback(self._background_tasks.discard)
 
             return {
                 "success": False,
@@ -497,6 +783,27 @@ class PaymentService:
                 "event_id": event_id
             }
 
+    async def _record_webhook_failure(self, webhook_event_id: ObjectId, error: Exception):
+        """Store a failed webhook's error message and stack trace"""
+        try:
+            await mongodb.database["webhook_events"].update_one(
+                {"_id": webhook_event_id},
+                {
+                    "$set": {
+                        "status": "failed",
+                        "error_message": str(error),
+                        "error_stack": "".join(
+                            traceback.format_exception(
+                                type(error), error, error.__traceback__, limit=-WEBHOOK_TRACEBACK_FRAMES
+                            )
+                        ),
+                        "updated_at": datetime.utcnow()
+                    }
+                }
+            )
+        except Exception as e:
+            logger.error(f"Failed to record webhook failure for {webhook_event_id}: {str(e)}")
+
     async def _process_webhook_event(self, event: str, payload: Dict[str, Any]) -> Dict[str, Any]:
         """
         Process different webhook event types
@@ -504,29 +811,36 @@ class PaymentService:
         Returns:
             Processing result for each event type
         """
-        from app.services.dunning_service import dunning_service
-
-        if event == "payment.captured":
-            return await self._handle_payment_captured(payload)
-
-        elif event == "payment.failed":
-            return await self._handle_payment_failed(payload)
-
-        elif event == "subscription.charged":
-            return await self._handle_subscription_charged(payload)
+        handler = self._webhook_handlers.get(event)
+        if handler:
+            return await handler(payload)
 
-        elif event == "subscription.cancelled":
-            return await self._handle_subscription_cancelled(payload)
+        logger.warning(f"Unhandled webhook event type: {event}")
+        return {"message": f"Event type '{event}' not handled"}
 
-        elif event == "subscription.paused":
-            return await self._handle_subscription_paused(payload)
-
-        elif event == "subscription.resumed":
-            return await self._handle_subscription_resumed(payload)
+    async def _find_payment_record(
+        self,
+        payment_id: Optional[str],
+        order_id: Optional[str]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Find the payment record matching a Razorpay payment or order ID
 
-        else:
-            logger.warning(f"Unhandled webhook event type: {event}")
-            return {"message": f"Event type '{event}' not handled"}
+        One indexed query, returning only the fields the webhook handlers use
+        """
+        # Only match on IDs the event actually carries ({"field": None} would also
+        # match records missing that field)
+        conditions = [
+            {field: value}
+            for field, value in (("razorpay_payment_id", payment_id), ("razorpay_order_id", order_id))
+            if value
+        ]
+        if not conditions:
+            return None
+        return await mongodb.database["payments"].find_one(
+            {"$or": conditions},
+            {"subscription_id": 1, "user_id": 1}
+        )
 
     async def _handle_payment_captured(self, payload: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -542,29 +856,36 @@ class PaymentService:
 
         # Find associated subscription by order_id or payment_id
         # This could be from initial payment or dunning retry
-        payment_record = await mongodb.database["payments"].find_one(
-            {"razorpay_payment_id": payment_id}
-        )
+        payment_record = await self._find_payment_record(payment_id, order_id)
 
         if payment_record:
             subscription_id = payment_record.get("subscription_id")
 
             if subscription_id:
-                # Check if this was a dunning retry that succeeded
-                dunning_attempt = await mongodb.database["dunning_attempts"].find_one({
-                    "subscription_id": subscription_id,
-                    "status": {"$in": ["pending", "attempted"]}
-                })
-
-                if dunning_attempt:
-                    # Dunning recovery successful!
-                    await dunning_service.mark_retry_success(subscription_id, payment_id)
-                    logger.info(f"Dunning recovery successful for subscription {subscription_id}")
-
-                # Update subscription status to active if it was past_due
-                await mongodb.database["subscriptions"].update_one(
-                    {"_id": subscription_id},
-                    {"$set": {"status": "active", "last_payment_at": datetime.utcnow()}}
+                async def resolve_dunning():
+                    # Check if this was a dunning retry that succeeded
+                    dunning_attempt = await mongodb.database["dunning_attempts"].find_one(
+                        {
+                            "subscription_id": subscription_id,
+                            "status": {"$in": ["pending", "attempted"]}
+                        },
+                        {"_id": 1}
+                    )
+
+                    if dunning_attempt:
+                        # Dunning recovery successful!
+                        await dunning_service.mark_retry_success(subscription_id, payment_id)
+                        logger.info(f"Dunning recovery successful for subscription {subscription_id}")
+
+                # The dunning check and the status update are independent (both leave
+                # the subscription active), so run them concurrently
+                await asyncio.gather(
+                    resolve_dunning(),
+                    # Update subscription status to active if it was past_due
+                    mongodb.database["subscriptions"].update_one(
+                        {"_id": subscription_id},
+                        {"$set": {"status": "active", "last_payment_at": datetime.utcnow()}}
+                    )
                 )
 
         return {
@@ -578,8 +899,6 @@ class PaymentService:
         Handle failed payment
         Trigger dunning process for recovery
         """
-        from app.services.dunning_service import dunning_service
-
         payment_entity = payload.get("payment", {}).get("entity", {})
         payment_id = payment_entity.get("id")
         error_code = payment_entity.get("error_code")
@@ -591,10 +910,8 @@ class PaymentService:
         # Look in order notes or payment metadata
         order_id = payment_entity.get("order_id")
 
-        # Try to find subscription from order
-        payment_record = await mongodb.database["payments"].find_one(
-            {"razorpay_order_id": order_id}
-        )
+        # Try to find subscription from order (or the payment itself)
+        payment_record = await self._find_payment_record(payment_id, order_id)
 
         if payment_record:
             subscription_id = payment_record.get("subscription_id")
@@ -639,6 +956,7 @@ class PaymentService:
         )
 
         if subscription:
+            now = datetime.utcnow()
             # Extend subscription period by 30 days
             new_period_end = subscription["period_end"] + timedelta(days=30)
 
@@ -648,9 +966,9 @@ class PaymentService:
                     "$set": {
                         "period_end": new_period_end,
                         "next_billing_date": new_period_end,
-                        "last_payment_at": datetime.utcnow(),
+                        "last_payment_at": now,
                         "status": "active",
-                        "updated_at": datetime.utcnow()
+                        "updated_at": now
                     }
                 }
             )
@@ -679,14 +997,15 @@ class PaymentService:
         )
 
         if subscription:
+            now = datetime.utcnow()
             # Mark as canceled
             await mongodb.database["subscriptions"].update_one(
                 {"_id": subscription["_id"]},
                 {
                     "$set": {
                         "status": "canceled",
-                        "canceled_at": datetime.utcnow(),
-                        "updated_at": datetime.utcnow()
+                        "canceled_at": now,
+                        "updated_at": now
                     }
                 }
             )
@@ -3,26 +3,59 @@ Simple Gemini ML Resource Indexer
 Direct Gemini API integration without function calling - just system prompt
 """
 
+import asyncio
 import google.generativeai as genai
 from app.core.config import settings
+from app.services.gemini_service import gemini_service
 from app.services.url_extractor_service import url_extractor_service
-import json
+import orjson
 import re
+import time
+from collections import OrderedDict
+from functools import lru_cache
 from typing import Dict, Any, List, Optional
 
-
-class SimpleGeminiIndexer:
-    def __init__(self):
-        self.model = None
-        if settings.GOOGLE_GEMINI_API_KEY:
-            try:
-                genai.configure(api_key=settings.GOOGLE_GEMINI_API_KEY)
-            except Exception as e:
-                print(f"Failed to configure Gemini API: {e}")
-                return
-
-            # System prompt for the indexer
-            self.system_prompt = """You are a Specialized ML/AI Resource Indexer and Assistant.
+# JSON wrapped in a markdown code block
+MARKDOWN_JSON_RE = re.compile(r'```(?:json)?\s*(.*?)\s*```', re.DOTALL)
+
+
+def _extract_first_json_object(text: str) -> Optional[str]:
+    """
+    Return the first balanced top-level {...} in text that contains "data_sources"
+
+    Single pass tracking brace depth (braces inside quoted strings are ignored), so
+    the cost stays linear however long the surrounding prose is.
+    """
+    depth = 0
+    start = -1
+    in_string = escaped = False
+
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = depth > 0
+        elif char == "{":
+            if depth == 0:
+                start = i
+            depth += 1
+        elif char == "}" and depth > 0:
+            depth -= 1
+            if depth == 0:
+                candidate = text[start:i + 1]
+                if '"data_sources"' in candidate:
+                    return candidate
+
+    return None
+
+
+# System prompt for the indexer
+INDEXER_SYSTEM_PROMPT = """You are a Specialized ML/AI Resource Indexer and Assistant.
 
 OBJECTIVE:
 Search for and index Machine Learning and AI resources (datasets and models) relevant to the user's query, and provide a helpful, conversational response.
@@ -82,32 +115,103 @@ CRITICAL: The response must be parseable as JSON. Do NOT include markdown code b
 
 For each user query, provide relevant, real resources from Kaggle and HuggingFace that match their needs. IMPORTANT: Include actual dataset URLs in your user_message text so they can be extracted and validated. The user_message should be friendly and guide the user on what to do next."""
 
+
+@lru_cache(maxsize=4)
+def _get_model(model_name: str, system_prompt: str) -> genai.GenerativeModel:
+    """One GenerativeModel per (model, prompt), shared by every indexer instance"""
+    return genai.GenerativeModel(model_name=model_name, system_instruction=system_prompt)
+
+
+class SimpleGeminiIndexer:
+    def __init__(self):
+        # Recent responses by (model, history, query): repeated questions (demos,
+        # retries, re-renders) skip the Gemini round trip for response_cache_ttl seconds
+        self.response_cache_size = 256
+        self.response_cache_ttl = 3600.0
+        self._response_cache: OrderedDict = OrderedDict()
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+
+        self.model = None
+        # Reuse the process-wide Gemini setup: calling genai.configure again would
+        # reset the SDK's shared clients (and the kept-alive connections behind them)
+        if gemini_service.is_available():
+            self.system_prompt = INDEXER_SYSTEM_PROMPT
+
             # Create model with system instruction (no tools)
             try:
-                self.model = genai.GenerativeModel(
-                    model_name=settings.GEMINI_MODEL,
-                    system_instruction=self.system_prompt
-                )
+                self.model = _get_model(settings.GEMINI_MODEL, self.system_prompt)
             except Exception as e:
                 print(f"Failed to load {settings.GEMINI_MODEL}, falling back to gemini-1.5-flash: {e}")
                 # Fallback to gemini-1.5-flash
                 try:
-                    self.model = genai.GenerativeModel(
-                        model_name="gemini-1.5-flash",
-                        system_instruction=self.system_prompt
-                    )
+                    self.model = _get_model("gemini-1.5-flash", self.system_prompt)
                 except Exception as e2:
                     print(f"Failed to load gemini-1.5-flash, trying gemini-pro: {e2}")
                     # Final fallback to gemini-pro
-                    self.model = genai.GenerativeModel(
-                        model_name="gemini-pro",
-                        system_instruction=self.system_prompt
-                    )
+                    self.model = _get_model("gemini-pro", self.system_prompt)
 
     def is_available(self) -> bool:
         """Check if the indexer is configured and ready"""
         return self.model is not None
 
+    async def _get_response_text(self, user_query: str, chat_history: Optional[List[Dict]]) -> str:
+        """Send the query (with history) to Gemini, answering repeats from the response cache"""
+        key = (
+            self.model.model_name,
+            tuple((msg["role"], msg["content"]) for msg in chat_history or ()),
+            user_query
+        )
+        cached = self._response_cache.get(key)
+        if cached is not None:
+            if cached[1] > time.monotonic():
+                self._response_cache.move_to_end(key)
+                print("Using cached Gemini response")
+                return cached[0]
+            del self._response_cache[key]
+
+        # Identical queries already in flight share one Gemini call (single-flight);
+        # shield keeps it running for the others if one caller is cancelled
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            inflight = asyncio.ensure_future(self._send_to_gemini(user_query, chat_history))
+            self._inflight[key] = inflight
+            inflight.add_done_callback(lambda _: self._inflight.pop(key, None))
+        response_text = await asyncio.shield(inflight)
+
+        if response_text:
+            self._response_cache[key] = (response_text, time.monotonic() + self.response_cache_ttl)
+            if len(self._response_cache) > self.response_cache_size:
+                self._response_cache.popitem(last=False)
+        return response_text
+
+    async def _send_to_gemini(self, user_query: str, chat_history: Optional[List[Dict]]) -> str:
+        """Run one chat turn against Gemini and return the concatenated response text"""
+        # Start chat with history if provided
+        if chat_history:
+            formatted_history = []
+            for msg in chat_history:
+                role = "user" if msg["role"] == "user" else "model"
+                formatted_history.append({
+                    "role": role,
+                    "parts": [msg["content"]]
+                })
+            chat = self.model.start_chat(history=formatted_history)
+        else:
+            chat = self.model.start_chat()
+
+        # Send user query
+        print(f"Sending query to Gemini: {user_query}")
+        response = await chat.send_message_async(user_query)
+
+        # Extract text response
+        response_text = ""
+        if response and hasattr(response, 'parts') and response.parts:
+            for part in response.parts:
+                if hasattr(part, "text") and part.text:
+                    response_text += part.text
+
+        return response_text
+
     async def process_query(self, user_query: str, chat_history: Optional[List[Dict]] = None) -> Dict[str, Any]:
         """
         Process user query and return ML resources as JSON
@@ -123,29 +227,7 @@ For each user query, provide relevant, real resources from Kaggle and HuggingFac
             raise ValueError("Gemini Indexer is not configured")
 
         try:
-            # Start chat with history if provided
-            if chat_history:
-                formatted_history = []
-                for msg in chat_history:
-                    role = "user" if msg["role"] == "user" else "model"
-                    formatted_history.append({
-                        "role": role,
-                        "parts": [msg["content"]]
-                    })
-                chat = self.model.start_chat(history=formatted_history)
-            else:
-                chat = self.model.start_chat()
-
-            # Send user query
-            print(f"Sending query to Gemini: {user_query}")
-            response = chat.send_message(user_query)
-
-            # Extract text response
-            response_text = ""
-            if response and hasattr(response, 'parts') and response.parts:
-                for part in response.parts:
-                    if hasattr(part, "text") and part.text:
-                        response_text += part.text
+            response_text = await self._get_response_text(user_query, chat_history)
 
             if not response_text:
                 print("No response text from Gemini")
@@ -168,15 +250,15 @@ For each user query, provide relevant, real resources from Kaggle and HuggingFac
             json_data = None
 
             # Method 1: Try to find JSON in markdown code blocks
-            json_match = re.search(r'```(?:json)?\s*(.*?)\s*```', response_text, re.DOTALL)
+            json_match = MARKDOWN_JSON_RE.search(response_text)
             if json_match:
                 json_str = json_match.group(1)
                 print("Found JSON in markdown code block")
             else:
                 # Method 2: Try to find JSON object directly
-                json_match = re.search(r'\{[\s\S]*"query"[\s\S]*"data_sources"[\s\S]*\}', response_text)
-                if json_match:
-                    json_str = json_match.group(0)
+                json_object = _extract_first_json_object(response_text)
+                if json_object:
+                    json_str = json_object
                     print("Found JSON object in response")
                 else:
                     # Method 3: Assume entire response is JSON
@@ -185,7 +267,7 @@ For each user query, provide relevant, real resources from Kaggle and HuggingFac
 
             # Parse JSON
             try:
-                json_data = json.loads(json_str)
+                json_data = orjson.loads(json_str)
                 print("Successfully parsed JSON")
 
                 # Validate structure
@@ -199,7 +281,7 @@ For each user query, provide relevant, real resources from Kaggle and HuggingFac
                             "huggingface_models": []
                         }
                     }
-            except json.JSONDecodeError as e:
+            except orjson.JSONDecodeError as e:
                 print(f"JSON parsing failed: {e}")
                 print(f"Attempted to parse: {json_str[:200]}...")
                 # Fallback: return empty structure